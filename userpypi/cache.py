@@ -0,0 +1,94 @@
+"""
+Precomputed pages for the simple index, and the modification times of
+packages and owners.
+
+pip and easy_install request the simple page of a package on every resolve,
+so the page is rendered once and served straight from the cache afterwards.
+It is dropped whenever one of its releases or distributions changes and
+rendered again by the next request for it.
+
+The modification times back the conditional GET support of the views, so
+that answering with 304 Not Modified only costs a cache lookup.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.template.loader import render_to_string
+
+from userpypi.models import Package, prefetch_distributions
+from userpypi.settings import (SIMPLE_PAGE_CACHE_TIMEOUT,
+                               MODIFIED_CACHE_TIMEOUT)
+
+SIMPLE_PAGE_KEY = 'userpypi:simple:%s:%s'
+PACKAGE_MODIFIED_KEY = 'userpypi:modified:%s:%s'
+OWNER_MODIFIED_KEY = 'userpypi:modified:%s'
+
+
+def simple_page_key(owner, package):
+    return SIMPLE_PAGE_KEY % (owner, package)
+
+def render_simple_page(package):
+    """ Render the simple page for package using two queries, regardless of
+    the number of releases and distributions """
+    releases = prefetch_distributions(package.releases.all(), package)
+    return render_to_string('userpypi/package_detail_simple.html',
+                            {'package': package, 'releases': releases})
+
+def cache_simple_page(package):
+    """ Render the simple page for package and store it in the cache. Returns
+    the rendered content. """
+    content = render_simple_page(package)
+    cache.set(simple_page_key(package.owner.username, package.name),
+              (package.private, content), SIMPLE_PAGE_CACHE_TIMEOUT)
+    return content
+
+def get_simple_page(owner, package):
+    """ Returns a (private, content) tuple for the cached simple page, or None
+    if the page has not been rendered yet """
+    return cache.get(simple_page_key(owner, package))
+
+def delete_simple_page(owner, package):
+    cache.delete(simple_page_key(owner, package))
+
+def touch_package(package, modified=None):
+    """ Record that package and the index of its owner changed. A deleted
+    package only touches the index. """
+    modified = modified or datetime.datetime.utcnow()
+    owner = package.owner.username
+    if package.pk is not None and Package.objects.filter(
+            pk=package.pk).update(modified=modified):
+        package.modified = modified
+        cache.set(PACKAGE_MODIFIED_KEY % (owner, package.name),
+                  (modified, package.private), MODIFIED_CACHE_TIMEOUT)
+    else:
+        cache.delete(PACKAGE_MODIFIED_KEY % (owner, package.name))
+    cache.set(OWNER_MODIFIED_KEY % owner, modified, MODIFIED_CACHE_TIMEOUT)
+
+def package_modified(owner, package):
+    """ Returns a (modified, private) tuple with the UTC time package of owner
+    last changed and whether it is private, or (None, None) if there is no
+    such package """
+    key = PACKAGE_MODIFIED_KEY % (owner, package)
+    cached = cache.get(key)
+    if cached is None:
+        cached = Package.objects.filter(owner__username=owner,
+            name=package).values_list('modified', 'private')[:1]
+        if not cached:
+            return None, None
+        cached = tuple(cached[0])
+        cache.set(key, cached, MODIFIED_CACHE_TIMEOUT)
+    return cached
+
+def owner_modified(owner):
+    """ The UTC time a package of owner last changed, or None if owner has
+    no packages """
+    key = OWNER_MODIFIED_KEY % owner
+    modified = cache.get(key)
+    if modified is None:
+        modified = Package.objects.filter(owner__username=owner).aggregate(
+            modified=Max('modified'))['modified']
+        if modified is None:
+            return None
+        cache.set(key, modified, MODIFIED_CACHE_TIMEOUT)
+    return modified
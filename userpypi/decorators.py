@@ -1,6 +1,11 @@
 from django.contrib.auth import login, REDIRECT_FIELD_NAME
+from django.contrib.auth.models import SiteProfileNotAvailable
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpResponseRedirect, HttpResponseForbidden
+from django.utils.hashcompat import md5_constructor
 from django.utils.http import urlquote
+from django.views.decorators.http import condition
 
 try:
     from functools import wraps, WRAPPER_ASSIGNMENTS
@@ -13,7 +18,10 @@ except ImportError:
     def available_attrs(fn):
         return tuple(a for a in WRAPPER_ASSIGNMENTS if hasattr(fn, a))
 
+from userpypi.cache import package_modified, owner_modified
 from userpypi.http import HttpResponseUnauthorized, login_basic_auth
+from userpypi.models import Package, Maintainer
+from userpypi.settings import PERMISSION_CACHE_TIMEOUT
 
 # Find us a csrf exempt decorator that'll work with Django 1.0+
 try:
@@ -24,6 +32,21 @@ except ImportError:
     except ImportError:
         def csrf_except(view_func): return view_func
 
+try:
+    from django.views.decorators.csrf import csrf_protect
+except ImportError:
+    def csrf_protect(view_func): return view_func
+
+# Effective permissions of a user on a package, Maintainer.permission uses the
+# first two.
+PERMISSION_READ = 0
+PERMISSION_WRITE = 1
+PERMISSION_OWNER = 2
+
+PERMISSION_KEY = 'userpypi:permission:%s:%s:%s:%s'
+PERMISSION_GENERATION_KEY = 'userpypi:permission-generation:%s:%s'
+PERMISSION_GENERATION_TIMEOUT = 60 * 60 * 24
+
 def basic_auth(view_func):
     """ Decorator for views that need to handle basic authentication such as
     distutils views. """
@@ -43,6 +66,94 @@ def basic_auth(view_func):
         return view_func(request, *args, **kwargs)
     return wraps(view_func, assigned=available_attrs(view_func))(_wrapped_view)
 
+def _permission_key(user, owner, package):
+    generation = cache.get(PERMISSION_GENERATION_KEY % (owner, package), 0)
+    return PERMISSION_KEY % (user.pk, owner, package, generation)
+
+def invalidate_package_permissions(owner, package):
+    """ Expire every cached permission for the package. Cached entries are
+    keyed by a per-package generation, so this is a single increment. """
+    key = PERMISSION_GENERATION_KEY % (owner, package)
+    cache.add(key, 0, PERMISSION_GENERATION_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+def _membership_permission(user, owner):
+    """ The permission a member of an organization account has on its
+    packages, or None """
+    try:
+        if not owner.profile.organization:
+            return None
+        membership = user.memberships.get(team=owner)
+    except (AttributeError, ObjectDoesNotExist, SiteProfileNotAvailable):
+        return None
+    if membership.permission >= 2:
+        return PERMISSION_WRITE
+    return PERMISSION_READ
+
+def get_package_permission(user, owner, package):
+    """
+    Returns a (package_id, permission) tuple for the package named package
+    owned by the user named owner. package_id is None when it does not exist
+    and permission is one of PERMISSION_OWNER, PERMISSION_WRITE,
+    PERMISSION_READ or None when user has no access beyond the public pages.
+    
+    The package, its owner and the maintainer permission of user are fetched
+    in a single query and the result is cached per user for
+    PERMISSION_CACHE_TIMEOUT seconds. Only the id of the package is cached,
+    views that need the package load it fresh, see
+    resolve_package_permission.
+    """
+    if not user.is_authenticated():
+        return None, None
+    
+    key = _permission_key(user, owner, package)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    
+    maintainer_permission = (
+        'SELECT MAX(m.permission) FROM %(maintainer)s m '
+        'WHERE m.package_id = %(package)s.id AND m.user_id = %%s' % {
+            'maintainer': Maintainer._meta.db_table,
+            'package': Package._meta.db_table})
+    
+    try:
+        obj = Package.objects.select_related('owner').extra(
+            select={'maintainer_permission': maintainer_permission},
+            select_params=(user.pk,)).get(owner__username=owner, name=package)
+    except Package.DoesNotExist:
+        return None, None
+    
+    if obj.owner_id == user.pk:
+        permission = PERMISSION_OWNER
+    elif obj.maintainer_permission is not None:
+        permission = min(int(obj.maintainer_permission), PERMISSION_WRITE)
+    else:
+        permission = _membership_permission(user, obj.owner)
+    
+    cache.set(key, (obj.pk, permission), PERMISSION_CACHE_TIMEOUT)
+    return obj.pk, permission
+
+def resolve_package_permission(request, owner, package):
+    """ Resolve the package and the permission of the requesting user and
+    attach them to the request as package and package_permission, so views
+    don't have to look the package up again. The package is read from the
+    database, never from the cache, since views save it. """
+    package_id, permission = get_package_permission(request.user, owner,
+                                                    package)
+    request.package = None
+    if package_id is not None:
+        try:
+            request.package = Package.objects.select_related('owner').get(
+                pk=package_id)
+        except Package.DoesNotExist:
+            permission = None
+    request.package_permission = permission
+    return request.package, request.package_permission
+
 def user_owns_package(login_url=None, redirect_field_name=REDIRECT_FIELD_NAME):
     """
     Decorator for views that checks whether the user owns the currently requested
@@ -56,7 +167,8 @@ def user_owns_package(login_url=None, redirect_field_name=REDIRECT_FIELD_NAME):
         def _wrapped_view(request, owner, package, *args, **kwargs):
             if request.user.username != owner:
                 return HttpResponseForbidden()
-            if request.user.packages_owned.filter(name=package).count() > 0:
+            obj, permission = resolve_package_permission(request, owner, package)
+            if permission == PERMISSION_OWNER:
                 return view_func(request, owner=owner, package=package, *args, **kwargs)
 
             path = urlquote(request.get_full_path())
@@ -68,21 +180,65 @@ def user_owns_package(login_url=None, redirect_field_name=REDIRECT_FIELD_NAME):
 def user_maintains_package(login_url=None, redirect_field_name=REDIRECT_FIELD_NAME):
     """
     Decorator for views that checks whether the user maintains (or owns) the
-    currently requested package.
+    currently requested package with write permission. When the url does not
+    name an owner the package is looked up in the requesting user's index.
     """
     if not login_url:
         from django.conf import settings
         login_url = settings.LOGIN_URL
 
     def decorator(view_func):
-        def _wrapped_view(request, owner, package, *args, **kwargs):
-            if (request.user.is_authenticated() and
-                (request.user.packages_owned.filter(name=package).count() > 0 or
-                 request.user.packages_maintained.filter(name=package).count() > 0)):
-                return view_func(request, owner, package=package, *args, **kwargs)
+        def _wrapped_view(request, owner=None, package=None, *args, **kwargs):
+            owner = owner or request.user.username
+            obj, permission = resolve_package_permission(request, owner, package)
+            if permission is not None and permission >= PERMISSION_WRITE:
+                return view_func(request, owner=owner, package=package, *args, **kwargs)
 
             path = urlquote(request.get_full_path())
             tup = login_url, redirect_field_name, path
             return HttpResponseRedirect('%s?%s=%s' % tup)
         return wraps(view_func, assigned=available_attrs(view_func))(_wrapped_view)
     return decorator
+
+def _page_etag(kind, modified, request, *names):
+    """ A strong ETag for a page of the given kind last modified at modified,
+    as seen by the requesting user with the current query string """
+    if modified is None:
+        return None
+    parts = (kind, modified.isoformat(), request.user.username,
+             request.GET.urlencode()) + names
+    return md5_constructor(u'|'.join(parts).encode('utf-8')).hexdigest()
+
+def package_condition(kind):
+    """
+    Decorator for the pages of a package, kind naming the page. Answers
+    conditional requests from the cached modification time of the package,
+    before the view runs any query. Private packages are left to the view
+    for everyone but their owner, so that the answer does not give them away.
+    """
+    def modified(request, owner, package):
+        modified, private = package_modified(owner, package)
+        if private and request.user.username != owner:
+            return None
+        return modified
+    
+    def last_modified(request, owner, package, **kwargs):
+        return modified(request, owner, package)
+    
+    def etag(request, owner, package, **kwargs):
+        return _page_etag(kind, modified(request, owner, package), request,
+                          owner, package, kwargs.get('version', u''))
+    
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+def owner_condition(kind):
+    """
+    Decorator for the package listings of an owner, see package_condition
+    """
+    def last_modified(request, owner, **kwargs):
+        return owner_modified(owner)
+    
+    def etag(request, owner, **kwargs):
+        return _page_etag(kind, owner_modified(owner), request, owner)
+    
+    return condition(etag_func=etag, last_modified_func=last_modified)
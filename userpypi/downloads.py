@@ -0,0 +1,105 @@
+"""
+Download counts of distributions, buffered in the cache.
+
+Counting a download must not cost a database write, so count_download only
+increments a counter in the cache. The counters are written to the
+downloads column of the distributions in batches by flush_downloads, which
+the flush_downloads management command runs periodically. The cache has to
+be shared by the web processes and the command, memcached for example.
+
+Counters are grouped in generations. Every distribution counted in a
+generation is recorded in a numbered slot of it, which is how
+flush_downloads finds the counters without being able to list cache keys.
+A flush closes the current generation and writes the generations before it,
+so downloads counted while a flush runs are never lost, they show up with
+the next one. The packages whose counts changed are touched, so pages
+validated by Package.modified show the new counts.
+"""
+from django.core.cache import cache
+from django.db.models import F
+
+from userpypi.cache import touch_package
+from userpypi.models import Distribution, Package
+from userpypi.settings import DOWNLOAD_COUNT_TIMEOUT
+
+GENERATION_KEY = 'userpypi:downloads:generation'
+FLUSHED_KEY = 'userpypi:downloads:flushed'
+SLOTS_KEY = 'userpypi:downloads:%d:slots'
+SLOT_KEY = 'userpypi:downloads:%d:slot:%d'
+COUNT_KEY = 'userpypi:downloads:%d:%s'
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, cache.get(FLUSHED_KEY, 0) + 1,
+                  DOWNLOAD_COUNT_TIMEOUT)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+def count_download(dist):
+    """ Count a download of dist """
+    generation = _generation()
+    key = COUNT_KEY % (generation, dist.pk)
+    if cache.add(key, 1, DOWNLOAD_COUNT_TIMEOUT):
+        slots = SLOTS_KEY % generation
+        cache.add(slots, 0, DOWNLOAD_COUNT_TIMEOUT)
+        try:
+            slot = cache.incr(slots)
+        except ValueError:
+            return
+        cache.set(SLOT_KEY % (generation, slot), dist.pk,
+                  DOWNLOAD_COUNT_TIMEOUT)
+    else:
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+def pending_downloads(generation):
+    """ Returns a {distribution_id: count} dict of the downloads counted in
+    generation """
+    slots = cache.get(SLOTS_KEY % generation) or 0
+    if not slots:
+        return {}
+    slot_keys = [SLOT_KEY % (generation, slot) for slot in
+                 range(1, slots + 1)]
+    dist_ids = cache.get_many(slot_keys).values()
+    count_keys = dict((COUNT_KEY % (generation, dist_id), dist_id) for
+                      dist_id in dist_ids)
+    counts = dict((count_keys[key], count) for key, count in
+                  cache.get_many(count_keys.keys()).iteritems())
+    cache.delete_many(slot_keys + count_keys.keys() + [SLOTS_KEY % generation])
+    return counts
+
+def flush_downloads():
+    """
+    Close the current generation and add the counts of the generations
+    before it to the downloads of their distributions, with one UPDATE per
+    distinct count, and touch their packages. Returns the number of
+    downloads written.
+    """
+    generation = _generation()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, generation + 1, DOWNLOAD_COUNT_TIMEOUT)
+
+    counts = {}
+    for flushed in range(cache.get(FLUSHED_KEY, 0) + 1, generation):
+        for dist_id, count in pending_downloads(flushed).iteritems():
+            counts[dist_id] = counts.get(dist_id, 0) + count
+    cache.set(FLUSHED_KEY, generation - 1, DOWNLOAD_COUNT_TIMEOUT)
+
+    by_count = {}
+    for dist_id, count in counts.iteritems():
+        by_count.setdefault(count, []).append(dist_id)
+    for count, dist_ids in by_count.iteritems():
+        Distribution.objects.filter(pk__in=dist_ids).update(
+            downloads=F('downloads') + count)
+    if counts:
+        packages = Package.objects.filter(
+            releases__distributions__in=counts.keys()).distinct()
+        for package in packages.select_related('owner'):
+            touch_package(package)
+    return sum(counts.values())
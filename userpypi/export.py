@@ -0,0 +1,166 @@
+"""
+Export of the simple indexes of owners as a static tree of files.
+
+Every page and file is written at the path of its url below the root of the
+tree, for example::
+
+    <root>/<owner>/simple/index.html
+    <root>/<owner>/simple/<package>/index.html
+    <root>/<owner>/files/<package>/<version>/<filename>
+
+so a front-end server serving the tree at the root of the site serves the
+public simple indexes without going through Django. The files of the
+distributions are only written when asked for. Private packages are never
+exported.
+
+After the first export of an owner only the packages modified since the
+previous one are written again, see Package.modified. Packages are touched
+inside the transaction that changes them, so a change can commit after an
+export read the packages while carrying an earlier time; the packages
+modified within SAFETY_MARGIN before the previous export are written again
+as well. Every file is written to a temporary file first and renamed into
+place, so readers never see a partially written page.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import urllib
+
+from django.core.urlresolvers import reverse
+
+from userpypi.cache import render_simple_page
+from userpypi.metadata import METADATA_SUFFIX
+from userpypi.models import Package, prefetch_distributions
+from userpypi.views.packages import simple_index
+
+# Name of the file keeping the time of the last export of an owner
+STATE_FILE = '.exported'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# Longer than any transaction touching a package, and than the clock skew
+# between the web servers and the exporting host
+SAFETY_MARGIN = datetime.timedelta(hours=1)
+
+
+class SimpleExport(object):
+    """
+    Writes the static simple index of owners below root, including the
+    distribution files if files is true.
+    """
+    def __init__(self, root, files=False):
+        self.root = root
+        self.files = files
+
+    def path(self, url):
+        """ The path of the file for url """
+        url = urllib.unquote(url.split('#', 1)[0])
+        return os.path.join(self.root, *url.strip('/').split('/'))
+
+    def write(self, path, chunks):
+        """ Atomically replace the file at path with the chunks """
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            fh = os.fdopen(fd, 'wb')
+            try:
+                for chunk in chunks:
+                    if isinstance(chunk, unicode):
+                        chunk = chunk.encode('utf-8')
+                    fh.write(chunk)
+            finally:
+                fh.close()
+            os.chmod(temp, 0644)
+            os.rename(temp, path)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+    def files_dir(self, owner, name):
+        """ The directory holding the files of the package name of owner """
+        url = reverse('userpypi-distribution', kwargs={
+            'owner': owner.username, 'package': name, 'version': '0',
+            'filename': 'file'})
+        return os.path.dirname(os.path.dirname(self.path(url)))
+
+    def last_export(self, simple_dir):
+        try:
+            fh = open(os.path.join(simple_dir, STATE_FILE))
+        except IOError:
+            return None
+        try:
+            return datetime.datetime.strptime(fh.read().strip(), TIME_FORMAT)
+        except ValueError:
+            return None
+        finally:
+            fh.close()
+
+    def export_owner(self, owner, full=False):
+        """
+        Export the simple index of owner. Unless full is true only the
+        packages modified since the last export are written. Returns the
+        number of packages written.
+        """
+        base_url = reverse('userpypi-package-index-simple',
+                           kwargs={'owner': owner.username})
+        simple_dir = self.path(base_url)
+        since = not full and self.last_export(simple_dir) or None
+        # Taken before reading so changes made during the export are picked
+        # up by the next one
+        started = datetime.datetime.utcnow()
+
+        packages = Package.objects.filter(owner=owner, private=False)
+        names = list(packages.order_by('name').values_list('name', flat=True))
+        self.write(os.path.join(simple_dir, 'index.html'),
+                   simple_index(base_url, names))
+
+        if since is not None:
+            packages = packages.filter(modified__gte=since - SAFETY_MARGIN)
+        count = 0
+        for package in packages.select_related('owner'):
+            self.export_package(package, simple_dir)
+            count += 1
+
+        # Packages that were deleted or made private since the last export,
+        # their files must not stay public either
+        for name in os.listdir(simple_dir):
+            path = os.path.join(simple_dir, name)
+            if os.path.isdir(path) and name not in names:
+                shutil.rmtree(path)
+                files = self.files_dir(owner, name)
+                if os.path.isdir(files):
+                    shutil.rmtree(files)
+
+        self.write(os.path.join(simple_dir, STATE_FILE),
+                   [started.strftime(TIME_FORMAT)])
+        return count
+
+    def export_package(self, package, simple_dir):
+        content = render_simple_page(package)
+        self.write(os.path.join(simple_dir, package.name, 'index.html'),
+                   [content])
+        if not self.files:
+            return
+        for release in prefetch_distributions(package.releases.all(), package):
+            for dist in release.distribution_list:
+                self.export_file(dist)
+
+    def export_file(self, dist):
+        """ Write the file of dist at the path of its url, and its metadata
+        file next to it, unless they are already there """
+        path = self.path(dist.get_absolute_url())
+        # An unrecorded size of 0 does not tell a truncated file either
+        files = [(path, dist.content, dist.size or None)]
+        if dist.metadata:
+            files.append((path + METADATA_SUFFIX, dist.metadata, None))
+        for path, content, size in files:
+            if os.path.exists(path) and (size is None or
+                                         os.path.getsize(path) == size):
+                continue
+            fh = content.storage.open(content.name, 'rb')
+            try:
+                self.write(path, fh.chunks())
+            finally:
+                fh.close()
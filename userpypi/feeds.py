@@ -1,3 +1,7 @@
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.http import Http404
+from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
 try:
     from django.contrib.syndication.views import Feed, FeedDoesNotExist
@@ -22,36 +26,52 @@ from userpypi.models import Package, Release
 
 
 class ReleaseFeed(Feed):
-    """ A feed of releases either for the site in general or for a specific 
-    package. """
+    """ A feed of releases either for the index of an owner or for a
+    specific package of it. The feed of an owner leaves out private
+    packages, the feed of a private package is only shown to its owner.
+    Either only changes with the package or owner, as the conditional
+    responses wrapping it expect. """
     
-    def get_object(self, request, package=None, **kwargs):
+    def get_object(self, request, owner, package=None, **kwargs):
         if package:
-            return get_object_or_404(Package, name=package)
-        return request.build_absolute_uri('/')
+            package = get_object_or_404(Package.objects.select_related('owner'),
+                                        owner__username=owner, name=package)
+            if package.private and request.user != package.owner:
+                raise Http404(u'No package named %s' % (package.name,))
+            return package
+        return get_object_or_404(User, username=owner)
     
     def link(self, obj):
         if isinstance(obj, Package):
             return obj.get_absolute_url()
-        return obj
+        return reverse('userpypi-index', kwargs={'owner': obj.username})
     
     def title(self, obj):
         if isinstance(obj, Package):
             return u'Releases for %s' % (obj.name,)
-        return u'Package index releases'
+        return u'Package index releases of %s' % (obj.username,)
     
     def description(self, obj):
         if isinstance(obj, Package):
             return u'Recent releases for the package: %s' % (obj.name,)
-        return u'Recent releases on the package index server'
+        return u'Recent releases on the package index of %s' % (obj.username,)
     
     def items(self, obj):
         if isinstance(obj, Package):
-            return obj.releases.filter(hidden=False).order_by('-created')[:25]
-        return Release.objects.filter(hidden=False).order_by('-created')[:40]
+            releases, count = obj.releases.all(), 25
+        else:
+            releases, count = Release.objects.filter(package__owner=obj,
+                package__private=False), 40
+        return releases.filter(hidden=False).annotate(
+            download_count=Sum('distributions__downloads')
+            ).order_by('-created')[:count]
     
     def item_description(self, item):
         if isinstance(item, Release):
+            downloads = item.download_count or 0
+            description = u'%d download%s' % (downloads,
+                                               downloads != 1 and 's' or '')
             if item.summary:
-                return item.summary
+                return u'%s (%s)' % (item.summary, description)
+            return description
         return super(ReleaseFeed, self).item_description(item)
\ No newline at end of file
@@ -1,8 +1,13 @@
+import hashlib
+
 from django.http import HttpResponse, QueryDict
 from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from django.utils.datastructures import MultiValueDict
 from django.contrib.auth import authenticate
 
+from userpypi.settings import UPLOAD_CHUNK_SIZE
+
 
 class HttpResponseNotImplemented(HttpResponse):
     status_code = 501
@@ -16,20 +21,192 @@ class HttpResponseUnauthorized(HttpResponse):
         self['WWW-Authenticate'] = 'Basic realm="%s"' % realm
 
 
-def parse_distutils_request(request):
+class HttpResponseRequestedRangeNotSatisfiable(HttpResponse):
+    status_code = 416
+
+    def __init__(self, size):
+        HttpResponse.__init__(self)
+        self['Content-Range'] = 'bytes */%d' % size
+
+
+class DistutilsMultiPartParser(object):
+    """ An incremental parser for the multipart bodies sent by distutils.
+    
+    The body is read from stream in chunks of chunk_size bytes and file parts
+    are written straight to temporary files, so memory use is bounded by the
+    chunk size rather than by the size of the uploaded distribution. Both the
+    \n\n header terminator that distutils sends and the \r\n\r\n one that
+    the RFC asks for are accepted.
+    
+    Iterating over the parser yields (headers, value) tuples, where value is
+    either a string or a TemporaryUploadedFile positioned at the start. The
+    md5 and sha256 digests of each file are computed while it is written and
+    stored as its md5_digest and sha256_digest attributes.
+    """
+    max_header_size = 64 * 1024
+    
+    def __init__(self, stream, boundary=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.stream = stream
+        self.boundary = boundary
+        self.chunk_size = chunk_size
+        self._buffer = ''
+        self._eof = False
+    
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
+    
+    def _find(self, needle):
+        """ Fill the buffer until needle is found, returning its index or -1
+        once the stream is exhausted. """
+        start = 0
+        while True:
+            index = self._buffer.find(needle, start)
+            if index >= 0:
+                return index
+            start = max(0, len(self._buffer) - len(needle))
+            if not self._fill():
+                return -1
+    
+    def _sniff_boundary(self):
+        """ Use the first line of the body as the delimiter when the boundary
+        was not part of the content type. """
+        while True:
+            stripped = self._buffer.lstrip()
+            if '\n' in stripped:
+                line = stripped.split('\n', 1)[0].rstrip('\r')
+                if line.startswith('--'):
+                    return line[2:]
+                break
+            if not self._fill():
+                break
+        raise ValueError('Invalid post data')
+    
+    def _read_headers(self):
+        while True:
+            ends = [(self._buffer.find(terminator), terminator)
+                    for terminator in ('\r\n\r\n', '\n\n')]
+            ends = [end for end in ends if end[0] >= 0]
+            if ends:
+                index, terminator = min(ends)
+                break
+            if len(self._buffer) > self.max_header_size or not self._fill():
+                raise ValueError('Invalid post data')
+        
+        header = self._buffer[:index]
+        self._buffer = self._buffer[index + len(terminator):]
+        return parse_header(';'.join(header.splitlines()))
+    
+    def _read_content(self, delimiter, write):
+        """ Pass the content of the current part to write, stopping at the
+        line ending before the next delimiter. Enough of the buffer is held
+        back between reads that a delimiter split over two chunks is never
+        written out. """
+        marker = '\n' + delimiter
+        keep = len(marker) + 1
+        while True:
+            index = self._buffer.find(marker)
+            if index >= 0:
+                content = self._buffer[:index]
+                if content.endswith('\r'):
+                    content = content[:-1]
+                write(content)
+                self._buffer = self._buffer[index + len(marker):]
+                return
+            if len(self._buffer) > keep:
+                write(self._buffer[:-keep])
+                self._buffer = self._buffer[-keep:]
+            if not self._fill():
+                raise ValueError('Invalid post data')
+    
+    def __iter__(self):
+        self._fill()
+        boundary = self.boundary or self._sniff_boundary()
+        delimiter = '--' + boundary
+        
+        index = self._find(delimiter)
+        if index < 0:
+            raise ValueError('Invalid post data')
+        self._buffer = self._buffer[index + len(delimiter):]
+        
+        while True:
+            while len(self._buffer.lstrip('\r\n')) < 2 and self._fill():
+                pass
+            if self._buffer.startswith('--'):
+                return
+            self._buffer = self._buffer.lstrip('\r\n')
+            if not self._buffer:
+                return
+            
+            headers = self._read_headers()
+            
+            if "filename" in headers:
+                value = TemporaryUploadedFile(name=headers["filename"],
+                                              size=0,
+                                              content_type="application/gzip",
+                                              charset='utf-8')
+                md5, sha256 = hashlib.md5(), hashlib.sha256()
+                def write(data):
+                    md5.update(data)
+                    sha256.update(data)
+                    value.write(data)
+                self._read_content(delimiter, write)
+                value.size = value.tell()
+                value.seek(0)
+                value.md5_digest = md5.hexdigest()
+                value.sha256_digest = sha256.hexdigest()
+            else:
+                parts = []
+                self._read_content(delimiter, parts.append)
+                value = ''.join(parts)
+            
+            if "name" in headers:
+                yield headers, value
+
+
+class DigestFileUploadHandler(TemporaryFileUploadHandler):
+    """ Upload handler that computes the md5 and sha256 digests of each file
+    as its chunks arrive, so distributions never have to be read back just to
+    be hashed. The digests are set as the md5_digest and sha256_digest
+    attributes of the uploaded file. """
+    
+    def new_file(self, *args, **kwargs):
+        super(DigestFileUploadHandler, self).new_file(*args, **kwargs)
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+    
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        self.sha256.update(raw_data)
+        return super(DigestFileUploadHandler, self).receive_data_chunk(raw_data,
+                                                                       start)
+    
+    def file_complete(self, file_size):
+        uploaded = super(DigestFileUploadHandler, self).file_complete(file_size)
+        uploaded.md5_digest = self.md5.hexdigest()
+        uploaded.sha256_digest = self.sha256.hexdigest()
+        return uploaded
+
+
+def parse_distutils_request(request, chunk_size=UPLOAD_CHUNK_SIZE):
     """ This is being used because the built in request parser that Django uses,
     django.http.multipartparser.MultiPartParser is interperting the POST data
     incorrectly and/or the post data coming from distutils is invalid.
     
     One portion of this is the end marker: \r\n\r\n (what Django expects) 
     versus \n\n (what distutils is sending). 
-    """
-    
-    try:
-        sep = request.raw_post_data.splitlines()[1]
-    except:
-        raise ValueError('Invalid post data')
     
+    The body is streamed from the request in chunks instead of being loaded
+    through raw_post_data, see DistutilsMultiPartParser.
+    """
+    boundary = parse_header(request.META.get('CONTENT_TYPE', '')).get('boundary')
+    parser = DistutilsMultiPartParser(request, boundary, chunk_size)
     
     request.POST = QueryDict('',mutable=True)
     try:
@@ -37,33 +214,11 @@ def parse_distutils_request(request):
     except Exception, e:
         pass
     
-    for part in filter(lambda e: e.strip(), request.raw_post_data.split(sep)):
-        try:
-            header, content = part.lstrip().split('\n',1)
-        except Exception, e:
-            continue
-        
-        if content.startswith('\n'):
-            content = content[1:]
-        
-        if content.endswith('\n'):
-            content = content[:-1]
-        
-        headers = parse_header(header)
-        
-        if "name" not in headers:
-            continue
-        
+    for headers, value in parser:
         if "filename" in headers:
-            dist = TemporaryUploadedFile(name=headers["filename"],
-                                         size=len(content),
-                                         content_type="application/gzip",
-                                         charset='utf-8')
-            dist.write(content)
-            dist.seek(0)
-            request.FILES.appendlist(headers['name'], dist)
+            request.FILES.appendlist(headers['name'], value)
         else:
-            request.POST.appendlist(headers["name"],content)
+            request.POST.appendlist(headers["name"], value)
     return
 
 def parse_header(header):
@@ -90,3 +245,36 @@ def login_basic_auth(request):
     auth = auth.strip().decode("base64")
     username, password = auth.split(":", 1)
     return authenticate(username=username, password=password)
+
+def parse_range_header(header, size):
+    """ Parse the value of a Range header for an entity of size bytes.
+    Returns the first and last byte position of the range, or None when the
+    header is missing, malformed or asks for several ranges, in which case
+    the whole entity should be sent. Raises ValueError when the range cannot
+    be satisfied. """
+    if not header or '=' not in header:
+        return None
+    unit, ranges = header.split('=', 1)
+    if unit.strip().lower() != 'bytes' or ',' in ranges or '-' not in ranges:
+        return None
+    start, end = [part.strip() for part in ranges.split('-', 1)]
+    if (start and not start.isdigit()) or (end and not end.isdigit()) or \
+            not (start or end):
+        return None
+    
+    if not start:
+        # A suffix range, the last end bytes
+        if not int(end) or not size:
+            raise ValueError('Empty suffix range')
+        return max(size - int(end), 0), size - 1
+    
+    start = int(start)
+    if end:
+        end = int(end)
+        if start > end:
+            return None
+    else:
+        end = size - 1
+    if start >= size:
+        raise ValueError('Range starts after the end of the entity')
+    return start, min(end, size - 1)
@@ -0,0 +1,32 @@
+"""
+Management command extracting the metadata files of distributions uploaded
+before they were extracted on upload, see userpypi.metadata.
+"""
+from django.core.management.base import NoArgsCommand, CommandError
+
+from userpypi import metadata
+from userpypi.models import Distribution
+
+
+class Command(NoArgsCommand):
+    help = """Extract the metadata file of every distribution that has
+none yet."""
+
+    def handle_noargs(self, **options):
+        if metadata.pkginfo is None:
+            raise CommandError('pkginfo is required to read metadata')
+        
+        count = 0
+        dists = Distribution.objects.filter(metadata='').select_related(
+            'release__package__owner')
+        for dist in dists.iterator():
+            try:
+                found = metadata.store_metadata(dist)
+            except (IOError, OSError), e:
+                print 'Skipping %s: %s' % (dist.filename, e)
+                continue
+            if found:
+                # Saved so that the simple page advertises the metadata
+                dist.save()
+                count += 1
+        print 'Extracted the metadata of %d distributions' % (count,)
@@ -0,0 +1,36 @@
+"""
+Management command writing the public simple indexes as static files, see
+userpypi.export.
+"""
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from userpypi.export import SimpleExport
+
+
+class Command(BaseCommand):
+    args = '<directory> [owner owner ...]'
+    help = """Export the simple index of the given owners, or of every owner,
+below directory. Only the packages changed since the last export are
+written again."""
+    option_list = BaseCommand.option_list + (
+        make_option('--files', action='store_true', default=False,
+                    help='Also export the distribution files'),
+        make_option('--full', action='store_true', default=False,
+                    help='Write every package, not only the changed ones'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Give the directory to export to')
+        export = SimpleExport(args[0], files=options['files'])
+        
+        owners = User.objects.filter(packages_owned__isnull=False).distinct()
+        if len(args) > 1:
+            owners = User.objects.filter(username__in=args[1:])
+        
+        for owner in owners:
+            count = export.export_owner(owner, full=options['full'])
+            print 'Exported %d packages of %s' % (count, owner.username)
@@ -0,0 +1,15 @@
+"""
+Management command writing the download counts buffered in the cache to the
+database, see userpypi.downloads. Run it periodically, from cron for example.
+"""
+from django.core.management.base import NoArgsCommand
+
+from userpypi.downloads import flush_downloads
+
+
+class Command(NoArgsCommand):
+    help = """Add the downloads counted since the last run to the download
+counts of the distributions."""
+
+    def handle_noargs(self, **options):
+        print 'Flushed %d downloads' % (flush_downloads(),)
@@ -0,0 +1,65 @@
+"""
+Management command deleting the stored distribution and metadata files that
+no distribution refers to anymore.
+
+Files are never deleted when their distribution is deleted or replaced: a
+deletion that is rolled back, or a concurrent upload of the same content
+addressed blob, would leave distributions pointing at missing files. Files
+modified within the last --min-age hours are left alone for the same
+reason.
+"""
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from userpypi.models import Distribution
+from userpypi.settings import RELEASE_UPLOAD_TO
+
+
+class Command(BaseCommand):
+    args = '[directory directory ...]'
+    help = """Delete the files below the given directories of the release
+file storage that no distribution refers to. The directories default to the
+blob directory of content addressed storage, or to RELEASE_UPLOAD_TO."""
+    option_list = BaseCommand.option_list + (
+        make_option('--min-age', type='int', default=24,
+                    help='Hours since a file was last modified before it '
+                         'may be deleted'),
+        make_option('--dry-run', action='store_true', default=False,
+                    help='Only list the files that would be deleted'),
+    )
+
+    def walk(self, storage, directory):
+        directories, files = storage.listdir(directory)
+        for name in files:
+            yield '%s/%s' % (directory, name)
+        for name in directories:
+            for path in self.walk(storage, '%s/%s' % (directory, name)):
+                yield path
+
+    def handle(self, *args, **options):
+        storage = Distribution._meta.get_field('content').storage
+        directories = args
+        if not directories:
+            directory = getattr(storage, 'blob_prefix', RELEASE_UPLOAD_TO)
+            if callable(directory):
+                raise CommandError('RELEASE_UPLOAD_TO is a callable, give '
+                                   'the directories to sweep')
+            directories = [directory]
+        
+        used = set(Distribution.objects.values_list('content', flat=True))
+        used.update(Distribution.objects.values_list('metadata', flat=True))
+        cutoff = datetime.datetime.now() - datetime.timedelta(
+            hours=options['min_age'])
+        
+        count = 0
+        for directory in directories:
+            for name in self.walk(storage, directory.strip('/')):
+                if name in used or storage.modified_time(name) > cutoff:
+                    continue
+                print 'Deleting %s' % (name,)
+                if not options['dry_run']:
+                    storage.delete(name)
+                count += 1
+        print '%d unused files' % (count,)
@@ -1,82 +1,51 @@
 """
+Management command for mirroring the master indexes into the index of their
+owners.
 
+Every master index is synced from the serial its last run reached, see
+userpypi.mirroring. The master index has to support the
+changelog_since_serial XMLRPC command.
 """
+import xmlrpclib
+from optparse import make_option
 
-from datetime import datetime
-import urllib
-import os.path
-from time import mktime
-from xmlrpclib import ServerProxy
-
-from django.core.files import File
 from django.core.management.base import BaseCommand
-from userpypi.models import *
 
+from userpypi.mirroring import MirrorSync, NETWORK_ERRORS
+from userpypi.models import MasterIndex
+from userpypi.settings import (MIRROR_BATCH_SIZE, MIRROR_WORKERS,
+                               MIRROR_DOWNLOAD_WORKERS)
 
 
 class Command(BaseCommand):
-    help = """Load all classifiers from pypi. If any arguments are given,
-they will be used as paths or urls for classifiers instead of using the
-official pypi list url"""
+    help = """Apply the changes of every master index since the last run to
+the index of its owner. Interrupted runs resume from the last checkpoint."""
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=MIRROR_BATCH_SIZE,
+                    help='Number of changes applied between checkpoints'),
+        make_option('--workers', type='int', default=MIRROR_WORKERS,
+                    help='Number of concurrent metadata requests'),
+        make_option('--download-workers', type='int',
+                    default=MIRROR_DOWNLOAD_WORKERS,
+                    help='Number of concurrent downloads'),
+    )
 
     def handle(self, *args, **options):
         for index in MasterIndex.objects.all():
-            rpc = ServerProxy(index.url)
-            try:
-                last = index.logs.latest()
-            except:
-                print 'Error getting latest update for %s' % (str(index),)
+            if index.owner is None:
+                print 'Skipping %s, it has no owner to mirror into' % (index,)
                 continue
             
-            newer = MirrorLog.objects.create(master=index, created=datetime.now())
-            
-            print 'Looking at changes since: %d' % (mktime(last.created.timetuple()),)
-            for update in rpc.changelog(int(mktime(last.created.timetuple()))):
-                print str(update)
-                package, created = Package.objects.get_or_create(name=update[0])
-                
-                if update[3] == 'new release':
-                    release, created = Release.objects.get_or_create(
-                        package=package, version=update[1])
-                    
-                    if created:
-                        newer.releases_added.add(release)
-                    
-                    pkg_data = rpc.release_data(update[0],update[1])
-                    print 'Retrieved release data: %s' % (str(pkg_data),)
-                    if 'name' in pkg_data:
-                        del pkg_data['name']
-                    if 'version' in pkg_data:
-                        del pkg_data['version']
-                    
-                    for key, value in pkg_data.iteritems():
-                        if key != 'classifier':
-                            release.package_info[key] = value
-                        else:
-                            release.package_info.setlist(key, value)
-                    
-                    release.save()
-                elif update[3] == 'remove':
-                    Release.objects.filter(package=package, version=update[1]).delete()
-                elif update[3].startswith('add source file'):
-                    try:
-                        release = Release.objects.get(package=package,
-                                                      version=update[1])
-                    except Release.DoesNotExist:
-                        continue
-                    downloads = rpc.release_urls(update[0], update[1])
-                    for download in downloads:
-                        print 'Download data: %s' % (str(download),)
-                        dist, created = Distribution.objects.get_or_create(release=release,
-                            filetype=download['packagetype'],
-                            pyversion=download['python_version'])
-                        
-                        if not created and dist.md5_digest != download['md5_digest']:
-                            dist.md5_digest = download['md5_digest']
-                            dist.content = File(urllib.urlopen(download['url']))
-                        
-                        dist.comment = download['comment_text']
-                        
-                        dist.save()
-                
-        
\ No newline at end of file
+            print 'Looking at changes of %s since serial %d' % (
+                index, index.last_serial)
+            sync = MirrorSync(index, batch_size=options['batch_size'],
+                              workers=options['workers'],
+                              download_workers=options['download_workers'])
+            try:
+                count = sync.run()
+            except NETWORK_ERRORS + (xmlrpclib.Fault,), e:
+                print 'Error mirroring %s, stopped at serial %d: %s' % (
+                    index, index.last_serial, e)
+                continue
+            print 'Applied %d changes from %s, now at serial %d' % (
+                count, index, index.last_serial)
@@ -0,0 +1,166 @@
+"""
+Rendering of release descriptions from reStructuredText to HTML.
+
+Rendering a long description with docutils is slow, so the HTML is stored
+on the release when it is saved (see Release.rendered_description) and
+every rendering is cached under the hash of its source, which is what the
+saferst template filter looks up. The descriptions that failed to render are
+cached as plain text the same way, so they are not tried again, unless the
+failure was a timeout, which may not repeat.
+
+docutils runs in a pool of worker processes with a time and memory limit, so
+a pathological description cannot tie up a web process.
+"""
+from __future__ import with_statement
+
+import hashlib
+import threading
+from multiprocessing import Pool, TimeoutError
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str, force_unicode
+from django.utils.html import escape
+
+from userpypi.settings import (DESCRIPTION_CACHE_TIMEOUT, RST_RENDER_WORKERS,
+                               RST_RENDER_TIMEOUT, RST_RENDER_MEMORY_BUDGET,
+                               RST_RENDER_MAX_TASKS)
+
+DESCRIPTION_KEY = 'userpypi:description:%s'
+
+# Descriptions are untrusted, RESTRUCTUREDTEXT_FILTER_SETTINGS can override
+# these
+DOCUTILS_DEFAULTS = {
+    'raw_enabled': False,
+    'file_insertion_enabled': False,
+    'report_level': 5,
+    'halt_level': 5,
+}
+
+
+def description_hash(text):
+    return hashlib.sha1(smart_str(text)).hexdigest()
+
+def plain_text(text):
+    """ The HTML for text shown as it is, used when it cannot be rendered """
+    return u'<pre>%s</pre>' % escape(force_unicode(text))
+
+def _address_space():
+    """ The bytes of address space the current process uses, or None when
+    that cannot be told """
+    try:
+        fh = open('/proc/self/statm')
+        try:
+            pages = int(fh.read().split()[0])
+        finally:
+            fh.close()
+    except (IOError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize()
+
+def _limit_memory(budget):
+    """ Initializer of the rendering processes, letting them grow by at
+    most budget bytes beyond the address space they inherit from the
+    process that forked them """
+    if not budget or resource is None:
+        return
+    used = _address_space()
+    if used is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = used + budget
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _publish(source, overrides):
+    """ Runs in a rendering process """
+    from docutils.core import publish_parts
+    parts = publish_parts(source=source, writer_name="html4css1",
+                          settings_overrides=overrides)
+    return force_unicode(parts["fragment"])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = Pool(RST_RENDER_WORKERS, _limit_memory,
+                         (RST_RENDER_MEMORY_BUDGET,),
+                         maxtasksperchild=RST_RENDER_MAX_TASKS)
+        return _pool
+
+def _discard_pool(pool):
+    """ Kill the processes of pool, stuck rendering a document """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.terminate()
+
+def render_rst(text):
+    """
+    Render text as reStructuredText in one of RST_RENDER_WORKERS processes,
+    waiting at most RST_RENDER_TIMEOUT seconds for it. Raw HTML and file
+    inclusion directives are disabled.
+    
+    Returns (html, final). Documents that fail to render, or run out of the
+    RST_RENDER_MEMORY_BUDGET, are shown as plain text and final is true, as
+    they would fail again. When rendering timed out or no worker could be
+    had the plain text is returned with final false, the document may well
+    render the next time and the result must not be kept.
+    """
+    try:
+        import docutils
+    except ImportError:
+        return plain_text(text), True
+
+    overrides = dict(DOCUTILS_DEFAULTS)
+    overrides.update(getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS",
+                             dict()))
+    source = smart_str(text)
+
+    if not RST_RENDER_WORKERS:
+        try:
+            return _publish(source, overrides), True
+        except Exception:
+            return plain_text(text), True
+
+    try:
+        pool = _get_pool()
+        result = pool.apply_async(_publish, (source, overrides))
+    except Exception, e:
+        # Pools cannot be started from daemonic or restricted processes,
+        # and the pool may have been terminated by another thread
+        print 'Cannot render description: %s' % (e,)
+        return plain_text(text), False
+
+    try:
+        return result.get(RST_RENDER_TIMEOUT), True
+    except TimeoutError:
+        # The time spent waiting for a busy worker counts as well, so this
+        # says little about the document
+        _discard_pool(pool)
+        return plain_text(text), False
+    except Exception:
+        return plain_text(text), True
+
+def render_description(text, digest=None):
+    """ Returns (html, final) for the description text, rendered once per
+    distinct text. Only final renderings are cached, see render_rst. digest
+    is the description_hash of text when it is known already. """
+    key = DESCRIPTION_KEY % (digest or description_hash(text))
+    html = cache.get(key)
+    if html is not None:
+        return html, True
+    html, final = render_rst(text)
+    if final:
+        cache.set(key, html, DESCRIPTION_CACHE_TIMEOUT)
+    return html, final
@@ -0,0 +1,120 @@
+"""
+Core metadata files of distributions, served next to them as described by
+PEP 658 so that installers can resolve dependencies without downloading
+whole archives.
+
+The metadata is read with pkginfo: the METADATA file of wheels, and the
+PKG-INFO file of source distributions when it is reliable. Installers trust
+this file for the dependencies of the distribution, so PKG-INFO is only used
+from metadata version 2.2 on and when it does not mark Requires-Dist as
+dynamic (PEP 643). Older PKG-INFO files and eggs have no dependable
+Requires-Dist and get no metadata file. Without pkginfo installed no
+metadata files are written.
+"""
+import email
+import hashlib
+import os
+import tempfile
+
+from django.core.files.base import ContentFile
+
+try:
+    import pkginfo
+except ImportError:
+    pkginfo = None
+
+# Suffix of the url of the metadata file of a distribution
+METADATA_SUFFIX = '.metadata'
+
+# The first metadata version whose source distribution metadata is static
+STATIC_METADATA_VERSION = (2, 2)
+
+
+def _reader(filename):
+    """ The pkginfo class reading the metadata of filename, or None """
+    if pkginfo is None:
+        return None
+    filename = filename.lower()
+    if filename.endswith('.whl'):
+        return getattr(pkginfo, 'Wheel', None)
+    for extension in ('.tar.gz', '.tgz', '.tar.bz2', '.tar', '.zip'):
+        if filename.endswith(extension):
+            return pkginfo.SDist
+    return None
+
+def read_metadata(path, filename):
+    """ Returns the raw metadata file of the distribution called filename
+    stored at path, or None when it has none that can be read """
+    reader = _reader(filename)
+    if reader is None:
+        return None
+    try:
+        metadata = reader(path).read()
+    except (ValueError, IOError, OSError, EOFError, KeyError), e:
+        print 'No metadata in %s: %s' % (filename, e)
+        return None
+    if not metadata or not metadata.strip():
+        return None
+    if reader is pkginfo.SDist and not static_metadata(metadata):
+        return None
+    return metadata
+
+def static_metadata(metadata):
+    """ Whether the PKG-INFO file metadata of a source distribution can be
+    relied on for its dependencies """
+    headers = email.message_from_string(metadata)
+    try:
+        version = tuple(int(part) for part in
+                        headers.get('Metadata-Version', '').split('.'))
+    except ValueError:
+        return False
+    if version < STATIC_METADATA_VERSION:
+        return False
+    dynamic = [field.strip().lower() for field in
+               headers.get_all('Dynamic') or []]
+    return 'requires-dist' not in dynamic
+
+def _local_path(content):
+    """ Returns (path, temporary) with the path of a local copy of the file
+    of content, temporary telling whether it was made for the occasion """
+    if content._committed:
+        try:
+            return content.path, False
+        except NotImplementedError:
+            pass
+    elif hasattr(content.file, 'temporary_file_path'):
+        return content.file.temporary_file_path(), False
+
+    fd, path = tempfile.mkstemp(suffix=os.path.basename(content.name))
+    fh = os.fdopen(fd, 'wb')
+    try:
+        for chunk in content.chunks():
+            fh.write(chunk)
+    finally:
+        fh.close()
+        content.seek(0)
+    return path, True
+
+def store_metadata(dist):
+    """
+    Extract the metadata of the file of dist and store it as the metadata
+    file of dist, without saving dist. Returns whether metadata was found.
+    """
+    if _reader(dist.filename) is None or not dist.content:
+        return False
+
+    path, temporary = _local_path(dist.content)
+    try:
+        metadata = read_metadata(path, dist.filename)
+    finally:
+        if temporary:
+            os.remove(path)
+    if metadata is None:
+        return False
+
+    if isinstance(metadata, unicode):
+        metadata = metadata.encode('utf-8')
+    dist.metadata_sha256_digest = hashlib.sha256(metadata).hexdigest()
+    dist.metadata.save(dist.filename + METADATA_SUFFIX, ContentFile(metadata),
+                       save=False)
+    return True
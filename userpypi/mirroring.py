@@ -0,0 +1,299 @@
+"""
+Mirroring of master indexes into the index of their owner.
+
+The changelog of a master index is read from the serial the mirror reached
+last and applied in batches. The metadata of the releases changed in a batch
+is fetched by a pool of workers, their files are downloaded by a second
+pool, and the serial is checkpointed on the MasterIndex after every batch,
+so an interrupted sync resumes where it stopped instead of starting over.
+A network error that outlasts the retries stops the sync before the
+checkpoint of its batch, which is applied again by the next sync; only
+releases and files the master index refuses or serves broken are skipped.
+
+Database writes only happen in the calling thread, the workers only talk to
+the master index. Downloads are verified against the digest published by
+the master index before they are stored.
+"""
+import hashlib
+import httplib
+import socket
+import time
+import urllib2
+import xmlrpclib
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+from userpypi.models import (Package, Release, Distribution, MasterIndex,
+                             MirrorLog)
+from userpypi.settings import (MIRROR_BATCH_SIZE, MIRROR_WORKERS,
+                               MIRROR_DOWNLOAD_WORKERS, MIRROR_TIMEOUT,
+                               MIRROR_RETRIES, MIRROR_MAX_FILE_SIZE,
+                               UPLOAD_CHUNK_SIZE)
+
+# Errors after which a request to a master index is worth another attempt
+NETWORK_ERRORS = (IOError, socket.error, httplib.HTTPException,
+                  xmlrpclib.ProtocolError)
+
+
+class TimeoutTransport(xmlrpclib.Transport):
+    def __init__(self, timeout, *args, **kwargs):
+        xmlrpclib.Transport.__init__(self, *args, **kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = xmlrpclib.Transport.make_connection(self, host)
+        connection.timeout = self.timeout
+        return connection
+
+class SafeTimeoutTransport(xmlrpclib.SafeTransport):
+    def __init__(self, timeout, *args, **kwargs):
+        xmlrpclib.SafeTransport.__init__(self, *args, **kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = xmlrpclib.SafeTransport.make_connection(self, host)
+        connection.timeout = self.timeout
+        return connection
+
+def server_proxy(url, timeout=MIRROR_TIMEOUT):
+    """ An XMLRPC proxy for url whose requests time out. Proxies are not
+    thread safe, every worker needs its own. """
+    if url.startswith('https://'):
+        transport = SafeTimeoutTransport(timeout)
+    else:
+        transport = TimeoutTransport(timeout)
+    return xmlrpclib.ServerProxy(url, transport=transport)
+
+def retry(func, *args):
+    """ Call func(*args), retrying with an increasing delay when it fails
+    with a network error """
+    for attempt in range(MIRROR_RETRIES):
+        try:
+            return func(*args)
+        except NETWORK_ERRORS:
+            if attempt + 1 >= MIRROR_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+
+class DigestMismatch(IOError):
+    """ A download did not match the digest published by the master index """
+
+class FileTooLarge(Exception):
+    """ A download is larger than MIRROR_MAX_FILE_SIZE """
+
+def download_file(url, filename, md5_digest, timeout=MIRROR_TIMEOUT):
+    """
+    Download url to a temporary file a chunk at a time, hashing it as it
+    goes, and check it against md5_digest. Returns a TemporaryUploadedFile
+    carrying its size and digests, which file system storage moves into
+    place instead of copying it.
+    """
+    response = urllib2.urlopen(url, timeout=timeout)
+    try:
+        length = int(response.info().get('Content-Length') or 0)
+        if MIRROR_MAX_FILE_SIZE and length > MIRROR_MAX_FILE_SIZE:
+            raise FileTooLarge('%s is %d bytes' % (url, length))
+
+        fh = TemporaryUploadedFile(filename, 'application/octet-stream', 0,
+                                   None)
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                chunk = response.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if MIRROR_MAX_FILE_SIZE and size > MIRROR_MAX_FILE_SIZE:
+                    raise FileTooLarge('%s is over %d bytes' % (
+                        url, MIRROR_MAX_FILE_SIZE))
+                md5.update(chunk)
+                sha256.update(chunk)
+                fh.write(chunk)
+            if md5.hexdigest() != md5_digest:
+                raise DigestMismatch('%s has md5 %s instead of %s' % (
+                    url, md5.hexdigest(), md5_digest))
+        except:
+            fh.close()
+            raise
+    finally:
+        response.close()
+
+    fh.flush()
+    fh.seek(0)
+    fh.size = size
+    fh.md5_digest = md5.hexdigest()
+    fh.sha256_digest = sha256.hexdigest()
+    return fh
+
+
+class MirrorSync(object):
+    """
+    Applies the changelog of a master index to the index of its owner.
+    """
+    def __init__(self, index, batch_size=MIRROR_BATCH_SIZE,
+                 workers=MIRROR_WORKERS,
+                 download_workers=MIRROR_DOWNLOAD_WORKERS):
+        self.index = index
+        self.batch_size = batch_size
+        self.workers = workers
+        self.download_workers = download_workers
+
+    def run(self):
+        """ Apply every changelog entry after the last checkpoint. Returns
+        the number of entries applied. """
+        rpc = server_proxy(self.index.url)
+        entries = retry(rpc.changelog_since_serial, self.index.last_serial)
+        if not entries:
+            return 0
+        entries.sort(key=lambda entry: entry[4])
+
+        self.log = MirrorLog.objects.create(master=self.index,
+                                            created=datetime.now())
+        metadata_pool = ThreadPool(self.workers)
+        download_pool = ThreadPool(self.download_workers)
+        try:
+            for start in range(0, len(entries), self.batch_size):
+                batch = entries[start:start + self.batch_size]
+                self.apply_batch(batch, metadata_pool, download_pool)
+                self.checkpoint(batch[-1][4])
+        finally:
+            metadata_pool.terminate()
+            download_pool.terminate()
+        return len(entries)
+
+    def checkpoint(self, serial):
+        MasterIndex.objects.filter(pk=self.index.pk).update(last_serial=serial)
+        self.index.last_serial = serial
+
+    def apply_batch(self, batch, metadata_pool, download_pool):
+        """ Apply a batch of changelog entries in order. The metadata of
+        every release they touch is fetched up front and their missing files
+        are downloaded at the end. """
+        keys = []
+        for name, version, timestamp, action, serial in batch:
+            if version and not action.startswith('remove') and \
+                    (name, version) not in keys:
+                keys.append((name, version))
+        metadata = dict((key, (data, urls)) for key, data, urls in
+                        metadata_pool.imap_unordered(self.fetch_release, keys)
+                        if data is not None)
+
+        downloads = []
+        for name, version, timestamp, action, serial in batch:
+            if action == 'remove':
+                releases = Release.objects.filter(
+                    package__owner=self.index.owner, package__name=name)
+                if version:
+                    releases = releases.filter(version=version)
+                removed = set(releases.values_list('pk', flat=True))
+                if version:
+                    releases.delete()
+                else:
+                    Package.objects.filter(owner=self.index.owner,
+                                           name=name).delete()
+                downloads = [(release, download) for release, download in
+                             downloads if release.pk not in removed]
+            elif action.startswith('remove file '):
+                self.remove_file(name, version, action[len('remove file '):])
+            elif (name, version) in metadata:
+                data, urls = metadata.pop((name, version))
+                release = self.update_release(name, version, data)
+                downloads.extend((release, download) for download in
+                                 self.missing_files(release, urls))
+            elif action == 'create':
+                Package.objects.get_or_create(owner=self.index.owner,
+                                              name=name)
+
+        for release, download, fh in download_pool.imap_unordered(
+                self.fetch_file, downloads):
+            if fh is None:
+                continue
+            try:
+                self.store_file(release, download, fh)
+            finally:
+                fh.close()
+
+    def fetch_release(self, key):
+        """ Runs in a worker: returns the key with the release_data and
+        release_urls of the release. Releases the master index answers with
+        a fault for are reported and returned without metadata, so that they
+        are skipped instead of stopping every sync at the same entry. """
+        name, version = key
+        rpc = server_proxy(self.index.url)
+        try:
+            return (key, retry(rpc.release_data, name, version),
+                    retry(rpc.release_urls, name, version))
+        except xmlrpclib.Fault, e:
+            print 'Skipping %s %s: %s' % (name, version, e)
+            return key, None, None
+
+    def fetch_file(self, item):
+        """ Runs in a worker: downloads and verifies the file of a
+        release_urls entry. Files that do not match their digest or are too
+        large are reported and skipped, they are retried with the next change
+        to the release. """
+        release, download = item
+        try:
+            fh = retry(download_file, download['url'], download['filename'],
+                       download['md5_digest'])
+        except (DigestMismatch, FileTooLarge), e:
+            print 'Skipping %s: %s' % (download['filename'], e)
+            fh = None
+        return release, download, fh
+
+    def update_release(self, name, version, data):
+        package, created = Package.objects.get_or_create(
+            owner=self.index.owner, name=name)
+        release, created = Release.objects.get_or_create(package=package,
+                                                         version=version)
+        if created:
+            self.log.releases_added.add(release)
+
+        for key, value in data.iteritems():
+            if key in ('name', 'version') or value is None:
+                continue
+            if key == 'classifiers':
+                key = 'classifier'
+            if isinstance(value, (list, tuple)):
+                release.package_info.setlist(key, list(value))
+            else:
+                release.package_info[key] = value
+
+        release.save()
+        return release
+
+    def missing_files(self, release, urls):
+        """ The release_urls entries of files that are missing or differ from
+        the local distributions of release """
+        existing = dict(((dist.filetype, dist.pyversion), dist.md5_digest)
+                        for dist in release.distributions.all())
+        return [download for download in urls if
+                existing.get((download['packagetype'],
+                              download['python_version'])) !=
+                download['md5_digest']]
+
+    def store_file(self, release, download, fh):
+        try:
+            dist = release.distributions.get(filetype=download['packagetype'],
+                pyversion=download['python_version'])
+        except Distribution.DoesNotExist:
+            dist = Distribution(release=release,
+                                filetype=download['packagetype'],
+                                pyversion=download['python_version'])
+
+        dist.md5_digest = fh.md5_digest
+        dist.sha256_digest = fh.sha256_digest
+        dist.comment = download.get('comment_text', '')
+        dist.content = fh
+        dist.save()
+
+    def remove_file(self, name, version, filename):
+        for dist in Distribution.objects.filter(
+                release__package__owner=self.index.owner,
+                release__package__name=name, release__version=version):
+            if dist.filename == filename:
+                dist.delete()
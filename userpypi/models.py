@@ -1,11 +1,15 @@
+import datetime
 import os
 from django.conf import settings
+from django.core.urlresolvers import reverse
 from django.db import models
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from django.utils import simplejson as json
 from django.utils.datastructures import MultiValueDict
 from django.contrib.auth.models import User
 
+from userpypi.markup import description_hash, render_description
 from userpypi.settings import (RELEASE_UPLOAD_TO, DIST_FILE_TYPES, 
     PYTHON_VERSIONS, DIST_FILE_TYPES, RELEASE_FILE_STORAGE)
 
@@ -13,14 +17,51 @@ from django.core.files.storage import get_storage_class
 
 FILE_STORAGE = get_storage_class(RELEASE_FILE_STORAGE)
 
+# package_info fields that are also stored in indexed columns of Release
+INDEXED_METADATA_FIELDS = ('summary', 'author', 'author_email', 'keywords',
+                           'license', 'requires_python')
+
+class PackageInfoDescriptor(object):
+    """
+    Keeps the JSON text loaded from the database and only decodes it into a
+    MultiValueDict the first time package_info is read, so loading a release
+    for its version or hidden flag does not pay for parsing its description.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.field.attname]
+        if not isinstance(value, MultiValueDict):
+            value = self.field.to_python(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
 class PackageInfoField(models.Field):
     description = u'Python Package Information Field'
-    __metaclass__ = models.SubfieldBase
 
     def __init__(self, *args, **kwargs):
         kwargs['editable'] = False
         super(PackageInfoField,self).__init__(*args, **kwargs)
 
+    def contribute_to_class(self, cls, name):
+        super(PackageInfoField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, PackageInfoDescriptor(self))
+
+    def is_loaded(self, instance):
+        """Whether the value of instance has been decoded or replaced since
+        it was loaded"""
+        return not isinstance(instance.__dict__.get(self.attname), basestring)
+
+    def pre_save(self, model_instance, add):
+        # Write text that was never decoded back as it is
+        return model_instance.__dict__.get(self.attname)
+
     def to_python(self, value):
         if isinstance(value, basestring):
             if value:
@@ -72,6 +113,12 @@ class Package(models.Model):
         related_name="packages_maintained",
         through='Maintainer')
     private = models.BooleanField(default=True)
+    latest_release = models.ForeignKey('Release', related_name='+',
+        null=True, blank=True, editable=False, on_delete=models.SET_NULL)
+    # UTC time of the last change to the package, its releases or their
+    # distributions, maintained by the signal handlers
+    modified = models.DateTimeField(default=datetime.datetime.utcnow,
+                                    editable=False)
 
     class Meta:
         verbose_name = _(u"package")
@@ -98,10 +145,9 @@ class Package(models.Model):
 
     @property
     def latest(self):
-        try:
-            return self.releases.latest()
-        except Release.DoesNotExist:
-            return None
+        """The most recently created release, maintained by the release
+        signal handlers."""
+        return self.latest_release
 
     def get_release(self, version):
         """Return the release object for version, or None"""
@@ -123,6 +169,27 @@ class Release(models.Model):
     package_info = PackageInfoField(blank=False)
     hidden = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True, editable=False)
+    # Copies of the most queried package_info fields, kept in sync by the
+    # release signal handlers so they can be searched and filtered on.
+    summary = models.CharField(max_length=255, blank=True, db_index=True,
+                               editable=False)
+    author = models.CharField(max_length=255, blank=True, db_index=True,
+                              editable=False)
+    author_email = models.CharField(max_length=255, blank=True,
+                                    db_index=True, editable=False)
+    keywords = models.CharField(max_length=255, blank=True, db_index=True,
+                                editable=False)
+    license = models.CharField(max_length=255, blank=True, db_index=True,
+                               editable=False)
+    requires_python = models.CharField(max_length=64, blank=True,
+                                       db_index=True, editable=False)
+    indexed_classifiers = models.ManyToManyField(Classifier, blank=True,
+        related_name='releases', editable=False)
+    # The description rendered to HTML and the hash of the source it was
+    # rendered from, see update_description_html.
+    description_html = models.TextField(blank=True, editable=False)
+    description_hash = models.CharField(max_length=40, blank=True,
+                                        editable=False)
 
     class Meta:
         verbose_name = _(u"release")
@@ -138,10 +205,6 @@ class Release(models.Model):
     def release_name(self):
         return u"%s-%s" % (self.package.name, self.version)
 
-    @property
-    def summary(self):
-        return self.package_info.get('summary', u'')
-
     @property
     def description(self):
         return self.package_info.get('description', u'')
@@ -150,6 +213,53 @@ class Release(models.Model):
     def classifiers(self):
         return self.package_info.getlist('classifier')
 
+    @property
+    def package_info_loaded(self):
+        """False until package_info is read or assigned, while the indexed
+        columns still match the stored text."""
+        return self._meta.get_field('package_info').is_loaded(self)
+
+    def copy_indexed_metadata(self):
+        """Copy the indexed fields out of package_info, truncated to the
+        size of their columns."""
+        for name in INDEXED_METADATA_FIELDS:
+            max_length = self._meta.get_field(name).max_length
+            value = self.package_info.get(name, u'') or u''
+            setattr(self, name, value.strip()[:max_length])
+
+    def update_description_html(self):
+        """Render the description again if it changed since it was last
+        rendered. Returns whether it did. The hash is left empty when the
+        rendering is not final, so it is rendered again on the next view."""
+        digest = description_hash(self.description)
+        if digest == self.description_hash:
+            return False
+        self.description_html, final = render_description(self.description,
+                                                          digest)
+        self.description_hash = final and digest or ''
+        return True
+
+    @property
+    def rendered_description(self):
+        """The description as HTML. Releases saved before descriptions were
+        stored rendered, or whose rendering timed out, have it rendered on
+        use and stored once it is final."""
+        if not self.description_hash:
+            self.update_description_html()
+            if self.description_hash and self.pk is not None:
+                Release.objects.filter(pk=self.pk).update(
+                    description_html=self.description_html,
+                    description_hash=self.description_hash)
+        return mark_safe(self.description_html)
+
+    @property
+    def distribution_list(self):
+        """The distributions of this release, loaded once. Set in bulk by
+        prefetch_distributions."""
+        if not hasattr(self, '_distribution_list'):
+            self._distribution_list = list(self.distributions.all())
+        return self._distribution_list
+
     @models.permalink
     def get_absolute_url(self):
         return ('userpypi-release', (), {
@@ -162,8 +272,19 @@ class Release(models.Model):
 class Distribution(models.Model):
     release = models.ForeignKey(Release, related_name="distributions",
                                 editable=False)
-    content = models.FileField(upload_to=RELEASE_UPLOAD_TO, storage=FILE_STORAGE())
+    content = models.FileField(upload_to=RELEASE_UPLOAD_TO, storage=FILE_STORAGE(),
+                               max_length=255, db_index=True)
     md5_digest = models.CharField(max_length=32, blank=True, editable=False)
+    sha256_digest = models.CharField(max_length=64, blank=True, editable=False)
+    # Size of the file in bytes, so listing files does not ask the storage
+    size = models.BigIntegerField(default=0, editable=False)
+    metadata = models.FileField(upload_to=RELEASE_UPLOAD_TO,
+                                storage=FILE_STORAGE(), max_length=255,
+                                blank=True, editable=False, db_index=True)
+    metadata_sha256_digest = models.CharField(max_length=64, blank=True,
+                                              editable=False)
+    # The requires_python of the release, HTML escaped for the simple page
+    requires_python_html = models.TextField(blank=True, editable=False)
     filetype = models.CharField(max_length=32, blank=False,
                                 choices=DIST_FILE_TYPES)
     pyversion = models.CharField(max_length=16, blank=True,
@@ -172,6 +293,7 @@ class Distribution(models.Model):
     signature = models.TextField(blank=True)
     created = models.DateTimeField(auto_now_add=True, editable=False)
     uploader = models.ForeignKey(User, editable=False, blank=True, null=True)
+    downloads = models.PositiveIntegerField(default=0, editable=False)
 
     @property
     def filename(self):
@@ -189,7 +311,17 @@ class Distribution(models.Model):
         return self.content.name
 
     def get_absolute_url(self):
-        return "%s#md5=%s" % (self.content.url, self.md5_digest)
+        release = self.release
+        if self.sha256_digest:
+            fragment = 'sha256=%s' % (self.sha256_digest,)
+        else:
+            fragment = 'md5=%s' % (self.md5_digest,)
+        return "%s#%s" % (reverse('userpypi-distribution', kwargs={
+            'owner': release.package.owner.username,
+            'package': release.package.name,
+            'version': release.version,
+            'filename': self.filename,
+        }), fragment)
 
     class Meta:
         verbose_name = _(u"distribution")
@@ -200,6 +332,62 @@ class Distribution(models.Model):
         return self.filename
 
 
+class SearchToken(models.Model):
+    """A token of one of the searchable fields of a release, maintained by
+    userpypi.search"""
+    release = models.ForeignKey(Release, related_name="search_tokens",
+                                editable=False)
+    field = models.CharField(max_length=32)
+    token = models.CharField(max_length=64, db_index=True)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ("release", "field", "token")
+
+    def __unicode__(self):
+        return u"%s:%s" % (self.field, self.token)
+
+class Journal(models.Model):
+    """An append-only log of the changes to the packages of an index, served
+    to mirrors by the XMLRPC changelog commands. The id is the serial of the
+    entry."""
+    owner = models.ForeignKey(User, related_name="journal", editable=False)
+    package = models.ForeignKey(Package, related_name="journal", null=True,
+                                editable=False, on_delete=models.SET_NULL)
+    name = models.CharField(max_length=255, editable=False)
+    version = models.CharField(max_length=128, blank=True, editable=False)
+    action = models.CharField(max_length=255, editable=False)
+    timestamp = models.DateTimeField(default=datetime.datetime.utcnow,
+                                     db_index=True, editable=False)
+    private = models.BooleanField(default=True, editable=False)
+
+    class Meta:
+        verbose_name = _(u"journal entry")
+        verbose_name_plural = _(u"journal entries")
+        get_latest_by = 'timestamp'
+        ordering = ['id']
+
+    def __unicode__(self):
+        return u"%s %s %s" % (self.name, self.version, self.action)
+
+def prefetch_distributions(releases, package=None):
+    """Load the distributions of all releases with a single query and cache
+    them on each release as its distribution_list. When the releases all
+    belong to package it is set on them, so that building the urls of the
+    distributions doesn't fetch it again. Returns releases."""
+    releases = list(releases)
+    by_release = dict((release.pk, release) for release in releases)
+    for release in releases:
+        release._distribution_list = []
+        if package is not None:
+            release.package = package
+    for dist in Distribution.objects.filter(release__in=by_release.keys()):
+        release = by_release[dist.release_id]
+        dist.release = release
+        release._distribution_list.append(dist)
+    return releases
+
+
 try:
     from south.modelsinspector import add_introspection_rules
     add_introspection_rules([], ["^userpypi\.models\.PackageInfoField"])
@@ -210,6 +398,10 @@ except ImportError:
 class MasterIndex(models.Model):
     title = models.CharField(max_length=255)
     url = models.CharField(max_length=255)
+    owner = models.ForeignKey(User, related_name='master_indexes', null=True,
+        blank=True, help_text=_(u"The index the packages are mirrored into."))
+    last_serial = models.PositiveIntegerField(default=0, editable=False,
+        help_text=_(u"Serial of the last changelog entry mirrored."))
     
     def __unicode__(self):
         return self.title
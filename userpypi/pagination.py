@@ -0,0 +1,59 @@
+from django.core.exceptions import ValidationError
+from django.db.models.query import Q
+
+from userpypi.settings import LIST_PAGE_SIZE
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates a ListView on the value of keyset_field instead of by page
+    number. Each page is fetched with a range condition on the (indexed)
+    keyset field followed by the primary key, so it costs the same whether
+    it is the first page or the thousandth.
+
+    The cursor of the next page is made available to the template as
+    next_cursor and is passed back in the ``after`` query string parameter.
+    A cursor that does not hold a valid value of the keyset field is ignored
+    and the first page is shown.
+    """
+    keyset_field = 'name'
+    keyset_descending = False
+    page_size = LIST_PAGE_SIZE
+
+    def get_cursor(self, obj):
+        return u'%s:%s' % (getattr(obj, self.keyset_field), obj.pk)
+
+    def paginate_keyset(self, queryset):
+        """ Returns the objects on the requested page and the cursor of the
+        next page, or None if this is the last page. """
+        field = self.keyset_field
+        if self.keyset_descending:
+            queryset = queryset.order_by('-%s' % field, '-pk')
+            compare = 'lt'
+        else:
+            queryset = queryset.order_by(field, 'pk')
+            compare = 'gt'
+
+        after = self.request.GET.get('after', '')
+        value, _, pk = after.rpartition(':')
+        try:
+            value = queryset.model._meta.get_field(field).to_python(value)
+        except ValidationError:
+            pk = ''
+        if pk.isdigit() and value is not None:
+            queryset = queryset.filter(
+                Q(**{'%s__%s' % (field, compare): value}) |
+                Q(**{field: value, 'pk__%s' % compare: pk}))
+
+        object_list = list(queryset[:self.page_size + 1])
+        if len(object_list) > self.page_size:
+            object_list = object_list[:self.page_size]
+            return object_list, self.get_cursor(object_list[-1])
+        return object_list, None
+
+    def get_context_data(self, **kwargs):
+        object_list, next_cursor = self.paginate_keyset(kwargs['object_list'])
+        kwargs['object_list'] = object_list
+        context = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        context['next_cursor'] = next_cursor
+        return context
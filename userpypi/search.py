@@ -0,0 +1,175 @@
+"""
+Inverted index over the releases, used by the package search view and the
+XMLRPC search command.
+
+Every release is indexed as one SearchToken row per distinct (field, token)
+pair, weighted by the importance of the field and the number of times the
+token occurs in it. The rows of a release are diffed against its metadata
+whenever it is saved, see index_release.
+"""
+import re
+
+from django.db.models import Count, Sum
+
+from userpypi.models import Release, SearchToken
+
+# Indexed fields and the weight of a single occurrence of a token in them
+FIELD_WEIGHTS = {
+    'name': 10,
+    'summary': 5,
+    'keywords': 5,
+    'author': 3,
+    'description': 1,
+}
+
+# Occurrences of a token beyond this do not make a release rank higher
+MAX_OCCURRENCES = 5
+
+STOP_WORDS = frozenset(('a', 'an', 'and', 'are', 'as', 'at', 'be', 'by',
+    'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this',
+    'to', 'with'))
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+TOKEN_MAX_LENGTH = SearchToken._meta.get_field('token').max_length
+
+
+def tokenize(text):
+    """ Split text into lower case tokens, dropping stop words """
+    return [token[:TOKEN_MAX_LENGTH] for token in
+            TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+def field_tokens(field, text):
+    """ Returns a {token: weight} dict of the tokens of text in field """
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return dict((token, FIELD_WEIGHTS[field] * min(count, MAX_OCCURRENCES))
+                for token, count in counts.iteritems())
+
+def release_tokens(name, package_info):
+    """ Returns a {(field, token): weight} dict of the tokens for a release
+    of the package called name with package_info """
+    tokens = {}
+    for field in FIELD_WEIGHTS:
+        if field == 'name':
+            text = name
+        else:
+            text = u' '.join(package_info.getlist(field))
+        for token, weight in field_tokens(field, text).iteritems():
+            tokens[(field, token)] = weight
+    return tokens
+
+def _update_tokens(existing, tokens):
+    """ Apply the difference between the existing {(release_id, field,
+    token): (pk, weight)} rows and the wanted {(release_id, field, token):
+    weight} tokens. """
+    stale = [pk for key, (pk, weight) in existing.iteritems()
+             if key not in tokens]
+    if stale:
+        SearchToken.objects.filter(pk__in=stale).delete()
+
+    new = []
+    for key, weight in tokens.iteritems():
+        if key not in existing:
+            release_id, field, token = key
+            new.append(SearchToken(release_id=release_id, field=field,
+                                   token=token, weight=weight))
+        elif existing[key][1] != weight:
+            SearchToken.objects.filter(pk=existing[key][0]).update(
+                weight=weight)
+
+    if hasattr(SearchToken.objects, 'bulk_create'):
+        SearchToken.objects.bulk_create(new)
+    else:
+        for token in new:
+            token.save()
+
+def _existing_tokens(queryset):
+    return dict(((release_id, field, token), (pk, weight)) for
+                pk, release_id, field, token, weight in
+                queryset.values_list('pk', 'release', 'field', 'token',
+                                     'weight'))
+
+def index_release(release):
+    """ Bring the index rows of release up to date with its metadata """
+    tokens = dict(((release.pk, field, token), weight) for
+                  (field, token), weight in
+                  release_tokens(release.package.name,
+                                 release.package_info).iteritems())
+    _update_tokens(_existing_tokens(release.search_tokens.all()), tokens)
+
+def index_package_name(package):
+    """ Bring the name tokens of every release of package up to date with
+    the package name, after it was renamed """
+    name_tokens = field_tokens('name', package.name)
+    existing = _existing_tokens(SearchToken.objects.filter(
+        release__package=package, field='name'))
+    tokens = {}
+    for release_id in package.releases.values_list('pk', flat=True):
+        for token, weight in name_tokens.iteritems():
+            tokens[(release_id, 'name', token)] = weight
+    _update_tokens(existing, tokens)
+
+def _match(field, value, releases):
+    """ Returns a {release_id: score} dict of the releases among releases
+    with every token of value in field """
+    tokens = set(tokenize(value))
+    if not tokens:
+        return {}
+
+    rows = SearchToken.objects.filter(field=field, token__in=tokens,
+                                      release__in=releases).values(
+        'release').annotate(matched=Count('token'), score=Sum('weight')
+        ).filter(matched=len(tokens))
+    return dict((row['release'], row['score']) for row in rows)
+
+def search(spec, operator='and', releases=None, limit=None):
+    """
+    Search releases with a PyPI search spec: a dict mapping field names to a
+    string or a list of strings. The strings of a field are combined with
+    "or", the fields with operator, either "and" or "or" in any case.
+    Unknown fields are ignored. Only releases in the releases queryset are
+    searched, by default every release that is not hidden.
+
+    Returns the matching releases, best match first and at most limit of
+    them, each with its score set as the score attribute.
+    """
+    if releases is None:
+        releases = Release.objects.filter(hidden=False)
+
+    scores = None
+    for field, values in spec.iteritems():
+        if field not in FIELD_WEIGHTS:
+            continue
+        if isinstance(values, basestring):
+            values = [values]
+
+        matches = {}
+        for value in values:
+            for release_id, score in _match(field, value, releases).iteritems():
+                matches[release_id] = max(matches.get(release_id, 0), score)
+
+        if scores is None:
+            scores = matches
+        elif operator.lower() == 'or':
+            for release_id, score in matches.iteritems():
+                scores[release_id] = scores.get(release_id, 0) + score
+        else:
+            scores = dict((release_id, score + matches[release_id]) for
+                          release_id, score in scores.iteritems()
+                          if release_id in matches)
+
+    if not scores:
+        return []
+
+    ranked = sorted(scores.iteritems(), key=lambda item: -item[1])[:limit]
+    releases = Release.objects.filter(pk__in=[pk for pk, score in ranked])
+    releases = dict((release.pk, release) for release in
+                    releases.select_related('package'))
+    results = []
+    for pk, score in ranked:
+        release = releases[pk]
+        release.score = score
+        results.append(release)
+    return results
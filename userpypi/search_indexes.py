@@ -19,9 +19,12 @@ if 'haystack' in settings.INSTALLED_APPS:
         description = CharField(stored=False, null=True,
                                 model_attr='latest__description')
         
+        def index_queryset(self):
+            return Package.objects.select_related('owner', 'latest_release')
+        
         def prepare_author(self, obj):
             output = []
-            for user in list(obj.owners.all()) + list(obj.maintainers.all()):
+            for user in [obj.owner] + list(obj.maintainers.all()):
                 output.append(user.get_full_name())
                 if user.email:
                     output.append(user.email)
@@ -7,7 +7,7 @@ import warnings
 DEFAULT_SETTINGS = {
     'ALLOW_VERSION_OVERWRITE': False, # This is disabled on pypi.python.org, can be useful if you make mistakes
     'RELEASE_UPLOAD_TO': 'dists', # The upload_to argument for the file field in releases. This can either be a string for a path relative to your media folder or a callable.
-    'RELEASE_FILE_STORAGE': settings.DEFAULT_FILE_STORAGE,
+    'RELEASE_FILE_STORAGE': settings.DEFAULT_FILE_STORAGE, # Set to 'userpypi.storage.ContentAddressedStorage' to store identical distribution files once across all indexes.
     'OS_NAMES': (
         ("aix", "AIX"),
         ("beos", "BeOS"),
@@ -83,13 +83,35 @@ DEFAULT_SETTINGS = {
         'package_releases': 'userpypi.views.xmlrpc.package_releases',
         'release_urls': 'userpypi.views.xmlrpc.release_urls',
         'release_data': 'userpypi.views.xmlrpc.release_data',
-        #'search': xmlrpc.search, Not done yet
-        #'changelog': xmlrpc.changelog, Not done yet
+        'search': 'userpypi.views.xmlrpc.search',
+        'changelog': 'userpypi.views.xmlrpc.changelog',
+        'changelog_last_serial': 'userpypi.views.xmlrpc.changelog_last_serial',
+        'changelog_since_serial': 'userpypi.views.xmlrpc.changelog_since_serial',
         #'ratings': xmlrpc.ratings, Not done yet
     },
     'PROXY_BASE_URL': 'http://pypi.python.org/simple',
     'PROXY_MISSING': False,
     'MIRRORING': False,
+    'UPLOAD_CHUNK_SIZE': 64 * 1024, # Number of bytes read from the request at a time when parsing distutils uploads.
+    'LIST_PAGE_SIZE': 100, # Number of packages or releases on each page of the html listings.
+    'PERMISSION_CACHE_TIMEOUT': 30, # Number of seconds the resolved permissions of a user on a package are cached.
+    'SIMPLE_PAGE_CACHE_TIMEOUT': 60 * 60 * 24 * 7, # Simple pages are re-rendered whenever a release or distribution changes, this only bounds how long stale entries live.
+    'DOWNLOAD_SENDFILE_HEADER': None, # 'X-Accel-Redirect' for nginx, or 'X-Sendfile' (Apache mod_xsendfile, lighttpd) to let the front-end server send distribution files.
+    'DOWNLOAD_ACCEL_REDIRECT_PREFIX': '/protected/', # Internal nginx location serving the root of the release file storage, used with X-Accel-Redirect.
+    'DOWNLOAD_CHUNK_SIZE': 64 * 1024, # Number of bytes read at a time when distribution files are streamed by Django.
+    'DOWNLOAD_COUNT_TIMEOUT': 60 * 60 * 24 * 7, # Seconds download counts are kept in the cache waiting for flush_downloads, which should run well within this.
+    'DESCRIPTION_CACHE_TIMEOUT': 60 * 60 * 24 * 7, # Seconds rendered descriptions are cached by the saferst filter, releases also keep theirs in the database.
+    'RST_RENDER_WORKERS': 2, # Number of processes rendering descriptions with docutils, 0 renders them in the web process without limits.
+    'RST_RENDER_TIMEOUT': 5, # Seconds a description may take to render before it is shown as plain text.
+    'RST_RENDER_MEMORY_BUDGET': 256 * 1024 * 1024, # Bytes of address space a rendering process may use beyond what it inherits from the web process, None for no limit.
+    'RST_RENDER_MAX_TASKS': 100, # Number of descriptions a rendering process renders before it is replaced.
+    'MODIFIED_CACHE_TIMEOUT': 60 * 60 * 24, # Seconds the modification times of packages and owners, used for conditional requests, are cached.
+    'MIRROR_BATCH_SIZE': 100, # Number of changelog entries update_mirrors applies between checkpoints.
+    'MIRROR_WORKERS': 4, # Number of concurrent metadata requests to a master index.
+    'MIRROR_DOWNLOAD_WORKERS': 4, # Number of concurrent distribution downloads from a master index.
+    'MIRROR_TIMEOUT': 30, # Seconds before a request to a master index times out.
+    'MIRROR_RETRIES': 3, # Number of attempts made for each request to a master index.
+    'MIRROR_MAX_FILE_SIZE': None, # Largest distribution in bytes that update_mirrors downloads, None for no limit.
 }
 
 USER_SETTINGS = DEFAULT_SETTINGS.copy()
@@ -1,59 +1,349 @@
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import signals
-from django.utils.hashcompat import md5_constructor
+from django.utils.html import escape
 
-from userpypi.models import Package, Release, Distribution
+from userpypi.cache import delete_simple_page, touch_package
+from userpypi.decorators import invalidate_package_permissions
+from userpypi.metadata import store_metadata
+from userpypi.models import (Package, Release, Distribution, Maintainer,
+                             Classifier, Journal)
+from userpypi.search import index_release, index_package_name
+from userpypi.utils import file_digests
 
 
 def autohide_new_release_handler(sender, instance, created, *args, **kwargs):
-    """ Autohide other releases on the creation of a new release when the 
-    package 'auto-hide' is True"""
-    if not created or not instance.package.auto_hide:
+    """ Point the package at a newly created release and, when the package
+    'auto-hide' is True, hide all of its other releases in one update """
+    if not created:
         return
     
-    for release in instance.package.releases.exclude(pk=instance.pk).filter(hidden=False):
-        release.hidden = True
-        release.save()
+    package = instance.package
+    Package.objects.filter(pk=package.pk).update(latest_release=instance)
+    package.latest_release = instance
+    # Package objects cached by the permission layer carry the old pointer
+    invalidate_package_permissions(package.owner.username, package.name)
+    
+    if not package.auto_hide:
+        return
+    
+    hide = package.releases.exclude(pk=instance.pk).filter(hidden=False)
+    for version in hide.values_list('version', flat=True):
+        journal(package, version, 'hide')
+    hide.update(hidden=True)
     
     if instance.hidden:
+        Release.objects.filter(pk=instance.pk).update(hidden=False)
         instance.hidden = False
-        instance.save()
 
 def autohide_save_release_handler(sender, instance, *args, **kwargs):
     """ When saving a release, check to see if it should be hidden or not """
     if instance.pk is None:
         return
     
-    if not instance.package.auto_hide:
-        return
+    package = instance.package
     
-    try:
-        latest = instance.package.releases.latest('created')
-    except Release.DoesNotExist:
+    if not package.auto_hide:
         return
     
-    if instance != latest and not instance.hidden:
+    if instance.pk != package.latest_release_id and not instance.hidden:
         instance.hidden = True
 
 def autohide_save_package_handler(sender, instance, *args, **kwargs):
+    """ Hide every release but the latest one of a package saved with
+    'auto-hide' set. The latest release is read from the database, the
+    instance being saved may have been loaded before it changed, and the
+    instance is corrected so the save does not write its stale pointer. """
+    if instance.pk is None:
+        return
+    
+    latest = Package.objects.filter(pk=instance.pk).values_list(
+        'latest_release', flat=True)
+    if latest and latest[0] != instance.latest_release_id:
+        instance.latest_release_id = latest[0]
+        if hasattr(instance, '_latest_release_cache'):
+            del instance._latest_release_cache
+    
     if not instance.auto_hide:
         return
     
-    for release in instance.releases.filter(hidden=False):
-        release.save()
+    hide = instance.releases.filter(hidden=False).exclude(
+        pk=instance.latest_release_id)
+    for version in hide.values_list('version', flat=True):
+        journal(instance, version, 'hide')
+    hide.update(hidden=True)
+
+def release_metadata_handler(sender, instance, *args, **kwargs):
+    """ Keep the indexed metadata columns and the rendered description in
+    sync with package_info """
+    if instance.pk is None or instance.package_info_loaded:
+        instance.copy_indexed_metadata()
+        instance.update_description_html()
+
+def release_classifiers_handler(sender, instance, created, *args, **kwargs):
+    """ Keep the indexed classifiers in sync with package_info, only
+    touching the rows that changed """
+    if not (created or instance.package_info_loaded):
+        return
+    
+    names = set(name.strip()[:255] for name in
+                instance.package_info.getlist('classifier') if name.strip())
+    current = set(instance.indexed_classifiers.values_list('name', flat=True))
+    if names == current:
+        return
+    
+    for name in names - current:
+        Classifier.objects.get_or_create(name=name)
+    if current - names:
+        instance.indexed_classifiers.remove(*(current - names))
+    if names - current:
+        instance.indexed_classifiers.add(*(names - current))
+
+def search_release_handler(sender, instance, created, *args, **kwargs):
+    """ Update the search index of a release when its metadata may have
+    changed """
+    if created or instance.package_info_loaded:
+        index_release(instance)
+
+def search_package_handler(sender, instance, created, *args, **kwargs):
+    if not created:
+        index_package_name(instance)
 
-def distribution_hash(sender, instance, *args, **kwargs):
-    if not instance.md5_digest and instance.content:
-        digest = md5_constructor()
+def latest_release_delete_handler(sender, instance, *args, **kwargs):
+    """ Point the package at its newest remaining release when the latest
+    release is deleted """
+    try:
+        package = Package.objects.get(pk=instance.package_id)
+    except Package.DoesNotExist:
+        return
+    
+    if package.latest_release_id not in (None, instance.pk):
+        return
+    
+    try:
+        latest = package.releases.exclude(pk=instance.pk).latest('created')
+    except Release.DoesNotExist:
+        latest = None
+    
+    Package.objects.filter(pk=package.pk).update(latest_release=latest)
+    invalidate_package_permissions(package.owner.username, package.name)
+
+def distribution_digests(sender, instance, *args, **kwargs):
+    """ Fill in the digests of a distribution before it is written. Uploads
+    that came through DistutilsMultiPartParser or DigestFileUploadHandler
+    already carry them, anything else is hashed a chunk at a time from the
+    file that is about to be stored. """
+    if (instance.md5_digest and instance.sha256_digest) or not instance.content:
+        return
+    
+    content = instance.content
+    md5_digest = sha256_digest = None
+    
+    if not content._committed:
+        md5_digest = getattr(content.file, 'md5_digest', None)
+        sha256_digest = getattr(content.file, 'sha256_digest', None)
+    
+    if not md5_digest or not sha256_digest:
         try:
-            fh = instance.content.storage.open(instance.content.name)
-            map(digest.update,fh.readlines())
-            fh.close()
-            instance.md5_digest = digest.hexdigest()
-            instance.save()
-        except Exception, e:
+            md5_digest, sha256_digest = file_digests(content)
+        except (IOError, OSError), e:
             print str(e)
+            return
+        finally:
+            if content._committed:
+                content.close()
+    
+    instance.md5_digest = instance.md5_digest or md5_digest
+    instance.sha256_digest = instance.sha256_digest or sha256_digest
+
+def distribution_size_handler(sender, instance, *args, **kwargs):
+    """ Record the size of a distribution whose file is being written """
+    if instance.content and not instance.content._committed:
+        instance.size = instance.content.size
+
+def distribution_metadata_handler(sender, instance, *args, **kwargs):
+    """ Extract the metadata file of a distribution whose file is being
+    uploaded, replacing the one of the file it had before """
+    if not instance.content or instance.content._committed:
+        return
+    
+    instance.metadata = ''
+    instance.metadata_sha256_digest = ''
+    try:
+        store_metadata(instance)
+    except (IOError, OSError), e:
+        print str(e)
+
+def requires_python_html(release):
+    """ The requires_python of release escaped for the simple page. It is
+    read from package_info, as the indexed column is truncated and a cut
+    specifier may allow Pythons the release does not support. """
+    return escape((release.package_info.get('requires_python', u'') or
+                   u'').strip())
+
+def distribution_requires_python_handler(sender, instance, *args, **kwargs):
+    """ Copy the requires_python of the release, escaped for the simple page """
+    instance.requires_python_html = requires_python_html(instance.release)
+
+def release_requires_python_handler(sender, instance, created, *args,
+                                    **kwargs):
+    """ Update the requires_python of the distributions of a release whose
+    metadata may have been edited """
+    if created or not instance.package_info_loaded:
+        return
+    html = requires_python_html(instance)
+    instance.distributions.exclude(requires_python_html=html).update(
+        requires_python_html=html)
+
+def journal(package, version, action, removed=False):
+    """ Append an entry to the journal of the index package belongs to.
+    Entries for removals are not linked to the package, which may be in the
+    middle of being deleted. """
+    Journal.objects.create(owner_id=package.owner_id,
+                           package=None if removed else package,
+                           name=package.name, version=version, action=action,
+                           private=package.private)
+
+def journal_package_handler(sender, instance, created, *args, **kwargs):
+    if created:
+        journal(instance, u'', 'create')
+    else:
+        Journal.objects.filter(package=instance).exclude(
+            private=instance.private).update(private=instance.private)
+
+def journal_package_delete_handler(sender, instance, *args, **kwargs):
+    journal(instance, u'', 'remove', removed=True)
+
+def journal_hidden_check(sender, instance, *args, **kwargs):
+    """ Remember whether a release is being hidden or shown by this save """
+    instance._hidden_changed = instance.pk is not None and \
+        Release.objects.filter(pk=instance.pk).exclude(
+            hidden=instance.hidden).exists()
+
+def journal_release_handler(sender, instance, created, *args, **kwargs):
+    if created:
+        journal(instance.package, instance.version, 'new release')
+    elif getattr(instance, '_hidden_changed', False):
+        journal(instance.package, instance.version,
+                instance.hidden and 'hide' or 'unhide')
+
+def journal_release_delete_handler(sender, instance, *args, **kwargs):
+    try:
+        package = instance.package
+    except ObjectDoesNotExist:
+        return
+    journal(package, instance.version, 'remove', removed=True)
+
+def journal_distribution_handler(sender, instance, created, *args, **kwargs):
+    if not created:
+        return
+    if instance.filetype == 'sdist':
+        action = 'add source file %s' % instance.filename
+    else:
+        action = 'add %s file %s' % (instance.pyversion or 'any',
+                                     instance.filename)
+    release = instance.release
+    journal(release.package, release.version, action)
+
+def journal_distribution_delete_handler(sender, instance, *args, **kwargs):
+    try:
+        release = instance.release
+        package = release.package
+    except ObjectDoesNotExist:
+        return
+    journal(package, release.version, 'remove file %s' % instance.filename,
+            removed=True)
+
+def simple_page_package_handler(sender, instance, *args, **kwargs):
+    """ Drop the cached simple page of a saved or deleted package. The page
+    is rendered again by the next request for it, which only sees the change
+    once it is committed. """
+    try:
+        delete_simple_page(instance.owner.username, instance.name)
+    except ObjectDoesNotExist:
+        pass
+
+def simple_page_release_handler(sender, instance, *args, **kwargs):
+    """ Drop the simple page of the package when one of its releases is
+    saved or deleted. When the whole package is being deleted the package is
+    already gone and the package handler drops the page. """
+    try:
+        simple_page_package_handler(sender, instance.package)
+    except ObjectDoesNotExist:
+        pass
+
+def simple_page_distribution_handler(sender, instance, *args, **kwargs):
+    try:
+        simple_page_package_handler(sender, instance.release.package)
+    except ObjectDoesNotExist:
+        pass
+
+def modified_package_handler(sender, instance, *args, **kwargs):
+    touch_package(instance)
+
+def modified_release_handler(sender, instance, *args, **kwargs):
+    """ Touch the package of a release or maintainer """
+    try:
+        touch_package(instance.package)
+    except ObjectDoesNotExist:
+        pass
+
+def modified_distribution_handler(sender, instance, *args, **kwargs):
+    try:
+        touch_package(instance.release.package)
+    except ObjectDoesNotExist:
+        pass
+
+def permission_package_handler(sender, instance, *args, **kwargs):
+    try:
+        invalidate_package_permissions(instance.owner.username, instance.name)
+    except ObjectDoesNotExist:
+        pass
+
+def permission_maintainer_handler(sender, instance, *args, **kwargs):
+    try:
+        package = instance.package
+    except ObjectDoesNotExist:
+        return
+    invalidate_package_permissions(package.owner.username, package.name)
 
 signals.post_save.connect(autohide_new_release_handler, sender=Release)
 signals.pre_save.connect(autohide_save_release_handler, sender=Release)
 signals.pre_save.connect(autohide_save_package_handler, sender=Package)
-signals.post_save.connect(distribution_hash, sender=Distribution)
+signals.post_delete.connect(latest_release_delete_handler, sender=Release)
+signals.pre_save.connect(release_metadata_handler, sender=Release)
+signals.post_save.connect(release_classifiers_handler, sender=Release)
+signals.post_save.connect(search_release_handler, sender=Release)
+signals.post_save.connect(search_package_handler, sender=Package)
+signals.pre_save.connect(distribution_digests, sender=Distribution)
+signals.pre_save.connect(distribution_size_handler, sender=Distribution)
+signals.pre_save.connect(distribution_metadata_handler, sender=Distribution)
+signals.pre_save.connect(distribution_requires_python_handler,
+                         sender=Distribution)
+signals.post_save.connect(release_requires_python_handler, sender=Release)
+signals.post_save.connect(simple_page_package_handler, sender=Package)
+signals.post_delete.connect(simple_page_package_handler, sender=Package)
+signals.post_save.connect(simple_page_release_handler, sender=Release)
+signals.post_delete.connect(simple_page_release_handler, sender=Release)
+signals.post_save.connect(simple_page_distribution_handler, sender=Distribution)
+signals.post_delete.connect(simple_page_distribution_handler, sender=Distribution)
+signals.post_save.connect(journal_package_handler, sender=Package)
+signals.post_delete.connect(journal_package_delete_handler, sender=Package)
+signals.pre_save.connect(journal_hidden_check, sender=Release)
+signals.post_save.connect(journal_release_handler, sender=Release)
+signals.post_delete.connect(journal_release_delete_handler, sender=Release)
+signals.post_save.connect(journal_distribution_handler, sender=Distribution)
+signals.post_delete.connect(journal_distribution_delete_handler,
+                            sender=Distribution)
+signals.post_save.connect(modified_package_handler, sender=Package)
+signals.post_delete.connect(modified_package_handler, sender=Package)
+signals.post_save.connect(modified_release_handler, sender=Release)
+signals.post_delete.connect(modified_release_handler, sender=Release)
+signals.post_save.connect(modified_distribution_handler, sender=Distribution)
+signals.post_delete.connect(modified_distribution_handler,
+                            sender=Distribution)
+signals.post_save.connect(modified_release_handler, sender=Maintainer)
+signals.post_delete.connect(modified_release_handler, sender=Maintainer)
+signals.post_save.connect(permission_package_handler, sender=Package)
+signals.post_delete.connect(permission_package_handler, sender=Package)
+signals.post_save.connect(permission_maintainer_handler, sender=Maintainer)
+signals.post_delete.connect(permission_maintainer_handler, sender=Maintainer)
@@ -0,0 +1,69 @@
+"""
+Content addressed storage for distribution files.
+
+Files are stored under the sha256 of their content, so the same artifact
+uploaded or mirrored into many indexes is only stored once and every
+distribution of it points at the same blob. Files are not deleted with their
+distributions, the sweep_files management command deletes the files no
+distribution refers to anymore.
+
+Enable it with::
+
+    DJANGOPYPI_SETTINGS = {
+        'RELEASE_FILE_STORAGE': 'userpypi.storage.ContentAddressedStorage',
+    }
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import force_unicode
+
+
+class ContentAddressedStorageMixin(object):
+    """
+    Names every saved file after the sha256 of its content and skips writing
+    files that are already stored. The original file name is kept as the
+    last path component, the upload_to directory is ignored so that the
+    files of all owners share the same blobs.
+    """
+    blob_prefix = 'blobs'
+
+    def blob_name(self, name, digest):
+        return '/'.join((self.blob_prefix, digest[:2], digest,
+                         os.path.basename(name)))
+
+    def digest(self, content):
+        """ The sha256 of content, taken from the digests computed when it
+        was uploaded or downloaded when possible """
+        for obj in (content, getattr(content, 'file', None)):
+            digest = getattr(obj, 'sha256_digest', None)
+            if digest:
+                return digest
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        return sha256.hexdigest()
+
+    def touch(self, name):
+        """ Mark the stored file name as recently used, so sweep_files
+        leaves a blob that is being reused alone """
+        try:
+            os.utime(self.path(name), None)
+        except (NotImplementedError, OSError):
+            pass
+
+    def save(self, name, content):
+        if name is None:
+            name = content.name
+        name = self.blob_name(name, self.digest(content))
+        if self.exists(name):
+            self.touch(name)
+            return force_unicode(name)
+        name = self._save(name, content)
+        return force_unicode(name.replace('\\', '/'))
+
+
+class ContentAddressedStorage(ContentAddressedStorageMixin, FileSystemStorage):
+    pass
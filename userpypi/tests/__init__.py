@@ -2,7 +2,7 @@ import os
 import unittest
 import xmlrpclib
 import StringIO
-#from userpypi.views import parse_distutils_request, simple
+from userpypi.http import parse_distutils_request
 from userpypi.models import Package, Classifier, Release, PackageInfoField, Distribution
 from django.test.client import Client
 from django.core.urlresolvers import reverse
@@ -51,8 +51,10 @@ Introduction
     }
     return data
 
+BOUNDARY = '--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
+
 def create_request(data):
-    boundary = '--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
+    boundary = BOUNDARY
     sep_boundary = '\n--' + boundary
     end_boundary = sep_boundary + '--'
     body = StringIO.StringIO()
@@ -73,29 +75,57 @@ def create_request(data):
 
     return body.getvalue()
 
+def create_upload_request(data, filename, content):
+    """ The body of a distutils upload of the file filename with content """
+    return create_request(data).replace(
+        '\n--' + BOUNDARY + '--',
+        '\n--' + BOUNDARY + '\nContent-Disposition: form-data; '
+        'name="content"; filename="%s"\n\n' % (filename,) + content +
+        '\n--' + BOUNDARY + '--')
+
+
+class MockRequest(object):
+
+    def __init__(self, raw_post_data):
+        self.stream = StringIO.StringIO(raw_post_data)
+        self.META = {}
+
+    def read(self, *args):
+        return self.stream.read(*args)
+
+    @property
+    def FILES(self):
+        return self._files
+
 
-# class MockRequest(object):
-# 
-#     def __init__(self, raw_post_data):
-#         self.raw_post_data = raw_post_data
-#         self.META = {}
-# 
-# 
-# class TestParseWeirdPostData(unittest.TestCase):
-# 
-#     def test_weird_post_data(self):
-#         data = create_post_data("submit")
-#         raw_post_data = create_request(data)
-#         post, files = parse_distutils_request(MockRequest(raw_post_data))
-#         self.assertTrue(post)
-# 
-#         for key in post.keys():
-#             if isinstance(data[key], list):
-#                 self.assertEquals(data[key], post.getlist(key))
-#             elif data[key] == "UNKNOWN":
-#                 self.assertTrue(post[key] is None)
-#             else:
-#                 self.assertEquals(post[key], data[key])
+class TestParseWeirdPostData(unittest.TestCase):
+
+    def test_weird_post_data(self):
+        data = create_post_data("submit")
+        raw_post_data = create_request(data)
+        # A tiny chunk size makes the boundary straddle chunks
+        for chunk_size in (7, 64 * 1024):
+            request = MockRequest(raw_post_data)
+            parse_distutils_request(request, chunk_size=chunk_size)
+            post = request.POST
+            self.assertTrue(post)
+
+            for key in post.keys():
+                if isinstance(data[key], list):
+                    self.assertEquals(data[key], post.getlist(key))
+                else:
+                    self.assertEquals(post[key], data[key])
+
+    def test_file_part_is_streamed_to_disk(self):
+        content = '\x00\n--binary\r\n' * 10000
+        raw_post_data = create_upload_request({'name': 'foo'},
+                                              'foo-1.0.tar.gz', content)
+        request = MockRequest(raw_post_data)
+        parse_distutils_request(request, chunk_size=1024)
+        uploaded = request.FILES['content']
+        self.assertEquals(uploaded.name, 'foo-1.0.tar.gz')
+        self.assertEquals(uploaded.size, len(content))
+        self.assertEquals(uploaded.read(), content)
 
 client = Client()
 
@@ -209,4 +239,568 @@ class TestXmlRpc(unittest.TestCase):
         expected = ['1.0']
         self.assertEqual(pypi_hits, expected)
     
-        
\ No newline at end of file
+        
+from django.db import connection
+from django.test import TestCase
+
+def count_queries(func, *args, **kwargs):
+    """ Returns the number of queries run by func(*args, **kwargs) """
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    start = len(connection.queries)
+    try:
+        func(*args, **kwargs)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+    return len(connection.queries) - start
+
+class QueryCountTestCase(TestCase):
+    """
+    Base class for tests checking that a page costs the same number of
+    queries no matter how many rows it shows, catching N+1 regressions.
+    """
+    def assertConstantQueries(self, url, grow):
+        """ Fetch url, call grow() to add rows, then fetch url again and
+        compare the number of queries of both requests """
+        before = count_queries(self.client.get, url)
+        grow()
+        after = count_queries(self.client.get, url)
+        self.assertEqual(before, after,
+                         '%s ran %d queries, %d after adding rows' % (
+                         url, before, after))
+
+class PackageTestCase(TestCase):
+    """
+    Base class for tests working on the package foo of the user owner.
+    """
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com',
+                                              'secret')
+        self.package = Package.objects.create(owner=self.owner, name='foo')
+    
+    def create_release(self, version='1.0', **package_info):
+        """ Create and return a release of the package with the values of
+        package_info """
+        release = Release(package=self.package, version=version)
+        for key, value in package_info.iteritems():
+            release.package_info[key] = value
+        release.save()
+        return release
+    
+    def create_distribution(self, release, filename='foo-1.0.tar.gz'):
+        return Distribution.objects.create(release=release, filetype='sdist',
+                                           content=filename)
+
+class TestListQueryCounts(QueryCountTestCase):
+    
+    def setUp(self):
+        self.owner = User.objects.create_user('lister', 'lister@example.com',
+                                              'secret')
+        self.client.login(username='lister', password='secret')
+        self.packages = 0
+    
+    def add_packages(self, count, releases=2):
+        for i in range(count):
+            self.packages += 1
+            package = Package.objects.create(owner=self.owner,
+                                             name='package%d' % self.packages)
+            for version in range(releases):
+                Release.objects.create(package=package,
+                                       version='1.%d' % version,
+                                       package_info={'summary': ['Package']})
+        return package
+    
+    def test_package_list(self):
+        url = reverse('userpypi-package-index', kwargs={'owner': 'lister'})
+        self.add_packages(2)
+        self.assertConstantQueries(url, lambda: self.add_packages(5))
+    
+    def test_release_list(self):
+        url = reverse('userpypi-release-list', kwargs={'owner': 'lister'})
+        self.add_packages(2)
+        self.assertConstantQueries(url, lambda: self.add_packages(5))
+    
+    def test_malformed_cursor_is_ignored(self):
+        url = reverse('userpypi-release-list', kwargs={'owner': 'lister'})
+        self.add_packages(1)
+        response = self.client.get(url, {'after': 'yesterday:1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['release_list']), 2)
+    
+    def test_package_doap(self):
+        package = self.add_packages(1)
+        url = reverse('userpypi-package-doap',
+                      kwargs={'owner': 'lister', 'package': package.name})
+        def add_releases():
+            for version in range(5):
+                Release.objects.create(package=package,
+                                       version='2.%d' % version,
+                                       package_info={'summary': ['Package']})
+        self.assertConstantQueries(url, add_releases)
+
+class TestReleaseMetadataColumns(PackageTestCase):
+    
+    def test_columns_follow_package_info(self):
+        release = Release.objects.create(package=self.package, version='1.0',
+            package_info={'summary': ['Foo'], 'author': ['Bob'],
+                          'classifier': ['Framework :: Django']})
+        self.assertEqual(release.summary, 'Foo')
+        self.assertEqual(Release.objects.get(author='Bob'), release)
+        self.assertEqual(list(Classifier.objects.get(
+            name='Framework :: Django').releases.all()), [release])
+        
+        release.package_info.setlist('classifier', [])
+        release.save()
+        self.assertFalse(release.indexed_classifiers.exists())
+    
+    def test_package_info_is_decoded_lazily(self):
+        self.create_release(summary='Foo', description='Long text')
+        release = Release.objects.get(package=self.package, version='1.0')
+        release.save()
+        self.assertFalse(release.package_info_loaded)
+        self.assertEqual(release.summary, 'Foo')
+        self.assertEqual(release.description, 'Long text')
+        self.assertTrue(release.package_info_loaded)
+
+class TestSearchIndex(TestCase):
+    
+    def setUp(self):
+        self.owner = User.objects.create_user('searcher',
+                                              'searcher@example.com', 'secret')
+    
+    def add_release(self, name, **info):
+        package = Package.objects.create(owner=self.owner, name=name)
+        return Release.objects.create(package=package, version='1.0',
+            package_info=dict((key, [value]) for key, value in info.items()))
+    
+    def test_spec_semantics(self):
+        from userpypi.search import search
+        web = self.add_release('webtools', summary='Web tools for Django')
+        django = self.add_release('django-pypi', summary='A package index')
+        self.add_release('unrelated', summary='Nothing to see')
+        
+        self.assertEqual(search({'name': 'django'}), [django])
+        self.assertEqual(
+            set(r.pk for r in search({'name': ['django', 'webtools']})),
+            set([django.pk, web.pk]))
+        self.assertEqual(
+            [r.pk for r in search({'name': 'django', 'summary': 'django'},
+                                  'or')],
+            [django.pk, web.pk])
+        self.assertEqual(
+            [r.pk for r in search({'name': 'django', 'summary': 'django'},
+                                  'OR')],
+            [django.pk, web.pk])
+        self.assertEqual(search({'name': 'django', 'summary': 'django'},
+                                'and'), [])
+    
+    def test_index_follows_changes(self):
+        from userpypi.search import search
+        release = self.add_release('foo', summary='Old words')
+        release.package_info.setlist('summary', ['New words'])
+        release.save()
+        self.assertEqual(search({'summary': 'old'}), [])
+        self.assertEqual(search({'summary': 'new'}), [release])
+        
+        release.package.name = 'bar'
+        release.package.save()
+        self.assertEqual(search({'name': 'bar'}), [release])
+        self.assertEqual(search({'name': 'foo'}), [])
+
+class TestJournal(PackageTestCase):
+    
+    def test_changes_are_journaled(self):
+        from userpypi.models import Journal
+        first = self.create_release('1.0')
+        self.create_release('1.1')
+        first.delete()
+        self.assertEqual(
+            list(Journal.objects.values_list('version', 'action')),
+            [(u'', u'create'), (u'1.0', u'new release'), (u'1.0', u'hide'),
+             (u'1.1', u'new release'), (u'1.0', u'remove')])
+
+class TestContentAddressedStorage(unittest.TestCase):
+    
+    def test_identical_files_are_stored_once(self):
+        import hashlib, shutil, tempfile
+        from django.core.files.base import ContentFile
+        from userpypi.storage import ContentAddressedStorage
+        
+        location = tempfile.mkdtemp()
+        try:
+            storage = ContentAddressedStorage(location=location)
+            first = storage.save('dists/foo-1.0.tar.gz', ContentFile('foo'))
+            second = storage.save('other/foo-1.0.tar.gz', ContentFile('foo'))
+            self.assertEqual(first, second)
+            self.assertTrue(hashlib.sha256('foo').hexdigest() in first)
+            self.assertTrue(first.endswith('/foo-1.0.tar.gz'))
+            self.assertEqual(storage.open(first).read(), 'foo')
+        finally:
+            shutil.rmtree(location)
+
+class TestConditionalGet(PackageTestCase):
+    
+    def test_unchanged_package_is_not_modified(self):
+        self.client.login(username='owner', password='secret')
+        self.create_release('1.0')
+        url = reverse('userpypi-package-simple',
+                      kwargs={'owner': 'owner', 'package': 'foo'})
+        
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.create_release('1.1')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+class TestListPackages(PackageTestCase):
+    
+    def list_packages(self, user, owner=None):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test.client import RequestFactory
+        from userpypi.views.xmlrpc import list_packages
+        request = RequestFactory().post('/pypi/')
+        request.user = user or AnonymousUser()
+        response = list_packages(request, owner=owner)
+        return xmlrpclib.loads(''.join(response))[0][0]
+    
+    def test_only_visible_packages_are_listed(self):
+        other = User.objects.create_user('other', 'other@example.com',
+                                         'secret')
+        Package.objects.create(owner=other, name='foo')
+        Package.objects.create(owner=other, name='secret', private=True)
+        Package.objects.create(owner=self.owner, name='mine', private=True)
+        self.assertEqual(self.list_packages(None), ['foo'])
+        self.assertEqual(self.list_packages(self.owner, 'owner'),
+                         ['foo', 'mine'])
+
+class TestUpload(PackageTestCase):
+    
+    def upload(self, content, md5_digest):
+        self.client.login(username='owner', password='secret')
+        data = {':action': 'file_upload', 'name': 'foo', 'version': '1.0',
+                'metadata_version': '1.0', 'filetype': 'sdist',
+                'md5_digest': md5_digest}
+        return self.client.post(reverse('userpypi-root',
+                                        kwargs={'owner': 'owner'}),
+            create_upload_request(data, 'foo-1.0.tar.gz', content),
+            content_type='multipart/form-data; boundary=%s' % (BOUNDARY,))
+    
+    def test_digests_and_size_are_stored(self):
+        import hashlib
+        content = 'gibberish' * 100
+        response = self.upload(content, hashlib.md5(content).hexdigest())
+        self.assertEqual(response.status_code, 200)
+        dist = Distribution.objects.get(release__package=self.package)
+        try:
+            self.assertEqual(dist.md5_digest, hashlib.md5(content).hexdigest())
+            self.assertEqual(dist.sha256_digest,
+                             hashlib.sha256(content).hexdigest())
+            self.assertEqual(dist.size, len(content))
+        finally:
+            dist.content.delete(save=False)
+    
+    def test_wrong_md5_digest_is_rejected(self):
+        import hashlib
+        response = self.upload('gibberish', hashlib.md5('other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Distribution.objects.exists())
+
+class TestReleaseFeed(PackageTestCase):
+    
+    def test_feed_is_scoped_to_owner(self):
+        other = User.objects.create_user('other', 'other@example.com',
+                                         'secret')
+        self.create_release('1.0')
+        Release.objects.create(version='2.0', package=Package.objects.create(
+            owner=other, name='elsewhere'))
+        Release.objects.create(version='3.0', package=Package.objects.create(
+            owner=self.owner, name='hidden', private=True))
+        
+        content = self.client.get(reverse('userpypi-rss',
+                                          kwargs={'owner': 'owner'})).content
+        self.assertTrue('foo' in content)
+        self.assertFalse('elsewhere' in content)
+        self.assertFalse('hidden' in content)
+        url = reverse('userpypi-package-rss',
+                      kwargs={'owner': 'other', 'package': 'foo'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+class TestSimplePageCache(PackageTestCase):
+    
+    def test_changes_drop_the_cached_page(self):
+        from userpypi.cache import get_simple_page
+        url = reverse('userpypi-package-simple',
+                      kwargs={'owner': 'owner', 'package': 'foo'})
+        self.create_release('1.0')
+        self.assertEqual(get_simple_page('owner', 'foo'), None)
+        self.client.get(url)
+        self.assertNotEqual(get_simple_page('owner', 'foo'), None)
+        
+        self.create_distribution(self.create_release('1.1'), 'foo-1.1.tar.gz')
+        self.assertEqual(get_simple_page('owner', 'foo'), None)
+        self.assertTrue('foo-1.1.tar.gz' in self.client.get(url).content)
+
+class TestRangeHeader(unittest.TestCase):
+    
+    def test_parse_range_header(self):
+        from userpypi.http import parse_range_header
+        self.assertEqual(parse_range_header('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range_header('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range_header('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range_header('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range_header(None, 100), None)
+        self.assertEqual(parse_range_header('bytes=0-1,5-6', 100), None)
+        self.assertEqual(parse_range_header('bytes=9-0', 100), None)
+        self.assertRaises(ValueError, parse_range_header, 'bytes=100-', 100)
+
+class TestDownloadCounts(PackageTestCase):
+    
+    def test_counts_are_flushed_in_batches(self):
+        from userpypi.downloads import count_download, flush_downloads
+        dist = self.create_distribution(self.create_release())
+        
+        count_download(dist)
+        count_download(dist)
+        self.assertEqual(Distribution.objects.get(pk=dist.pk).downloads, 0)
+        # The first flush closes the generation the downloads were counted in
+        flush_downloads()
+        modified = Package.objects.get(pk=self.package.pk).modified
+        self.assertEqual(flush_downloads(), 2)
+        self.assertEqual(Distribution.objects.get(pk=dist.pk).downloads, 2)
+        # Pages showing the counts are validated by the package modification
+        self.assertTrue(
+            Package.objects.get(pk=self.package.pk).modified > modified)
+
+class FakeResponse(StringIO.StringIO):
+    """ A urllib2 response without headers """
+    def info(self):
+        return {}
+
+class TestDownloadFile(unittest.TestCase):
+    
+    def setUp(self):
+        import urllib2
+        self.urlopen = urllib2.urlopen
+        urllib2.urlopen = lambda url, timeout=None: FakeResponse('content')
+    
+    def tearDown(self):
+        import urllib2
+        urllib2.urlopen = self.urlopen
+    
+    def test_digest_is_verified(self):
+        import hashlib
+        from userpypi.mirroring import download_file, DigestMismatch
+        fh = download_file('http://example.com/foo-1.0.tar.gz',
+                           'foo-1.0.tar.gz', hashlib.md5('content').hexdigest())
+        try:
+            self.assertEqual(fh.read(), 'content')
+            self.assertEqual(fh.size, len('content'))
+        finally:
+            fh.close()
+        self.assertRaises(DigestMismatch, download_file,
+                          'http://example.com/foo-1.0.tar.gz', 'foo-1.0.tar.gz',
+                          hashlib.md5('other').hexdigest())
+    
+    def test_size_is_limited(self):
+        import hashlib
+        from userpypi import mirroring
+        max_file_size = mirroring.MIRROR_MAX_FILE_SIZE
+        mirroring.MIRROR_MAX_FILE_SIZE = 4
+        try:
+            self.assertRaises(mirroring.FileTooLarge, mirroring.download_file,
+                              'http://example.com/foo-1.0.tar.gz',
+                              'foo-1.0.tar.gz',
+                              hashlib.md5('content').hexdigest())
+        finally:
+            mirroring.MIRROR_MAX_FILE_SIZE = max_file_size
+
+class FakeMasterIndex(object):
+    """ A master index with one new release whose metadata fails with
+    error """
+    def __init__(self, error):
+        self.error = error
+    
+    def changelog_since_serial(self, serial):
+        return [['foo', '1.0', 0, 'new release', 5]]
+    
+    def release_data(self, name, version):
+        raise self.error
+    
+    def release_urls(self, name, version):
+        return []
+
+class TestMirrorSync(PackageTestCase):
+    
+    def sync(self, error):
+        from userpypi import mirroring
+        from userpypi.models import MasterIndex
+        index = MasterIndex.objects.create(title='master', owner=self.owner,
+                                           url='http://example.com/pypi')
+        server_proxy, retries = mirroring.server_proxy, mirroring.MIRROR_RETRIES
+        mirroring.server_proxy = lambda url, timeout=None: FakeMasterIndex(
+            error)
+        mirroring.MIRROR_RETRIES = 1
+        try:
+            return index, mirroring.MirrorSync(index, workers=1,
+                                               download_workers=1).run()
+        finally:
+            mirroring.server_proxy = server_proxy
+            mirroring.MIRROR_RETRIES = retries
+    
+    def test_network_errors_keep_the_checkpoint(self):
+        import socket
+        from userpypi.models import MasterIndex
+        self.assertRaises(socket.error, self.sync, socket.error('down'))
+        self.assertEqual(MasterIndex.objects.get().last_serial, 0)
+    
+    def test_faults_are_skipped(self):
+        index, count = self.sync(xmlrpclib.Fault(1, 'No such release'))
+        self.assertEqual(count, 1)
+        self.assertEqual(index.last_serial, 5)
+        self.assertFalse(Release.objects.filter(version='1.0').exists())
+
+class TestSimpleExport(PackageTestCase):
+    
+    def test_export_is_incremental(self):
+        import shutil, tempfile
+        from userpypi.export import SimpleExport
+        owner = self.owner
+        Package.objects.create(owner=owner, name='secret', private=True)
+        self.create_release('1.0')
+        
+        root = tempfile.mkdtemp()
+        try:
+            export = SimpleExport(root)
+            self.assertEqual(export.export_owner(owner), 1)
+            simple = os.path.join(root, 'owner', 'simple')
+            self.assertTrue(os.path.exists(
+                os.path.join(simple, 'foo', 'index.html')))
+            self.assertFalse(os.path.exists(os.path.join(simple, 'secret')))
+            
+            self.assertEqual(export.export_owner(owner), 0)
+            self.create_release('1.1')
+            self.assertEqual(export.export_owner(owner), 1)
+            self.assertTrue('1.1' in open(
+                os.path.join(simple, 'foo', 'index.html')).read())
+            
+            files = export.files_dir(owner, 'foo')
+            os.makedirs(os.path.join(files, '1.1'))
+            self.package.private = True
+            self.package.save()
+            export.export_owner(owner)
+            self.assertFalse(os.path.exists(os.path.join(simple, 'foo')))
+            self.assertFalse(os.path.exists(files))
+        finally:
+            shutil.rmtree(root)
+
+class TestMetadata(unittest.TestCase):
+    
+    def sdist(self, directory, pkg_info):
+        import tarfile
+        path = os.path.join(directory, 'PKG-INFO')
+        open(path, 'w').write(pkg_info)
+        sdist = os.path.join(directory, 'foo-1.0.tar.gz')
+        archive = tarfile.open(sdist, 'w:gz')
+        archive.add(path, 'foo-1.0/PKG-INFO')
+        archive.close()
+        return sdist
+    
+    def test_only_static_sdist_metadata_is_read(self):
+        import shutil, tempfile
+        from userpypi import metadata
+        if metadata.pkginfo is None:
+            self.skipTest('pkginfo is not installed')
+        
+        directory = tempfile.mkdtemp()
+        try:
+            path = self.sdist(directory, 'Metadata-Version: 2.2\nName: foo\n'
+                              'Version: 1.0\nRequires-Dist: bar\n')
+            self.assertTrue('Requires-Dist: bar' in
+                            metadata.read_metadata(path, 'foo-1.0.tar.gz'))
+            self.assertEqual(metadata.read_metadata(path, 'foo-1.0.exe'), None)
+            
+            path = self.sdist(directory, 'Metadata-Version: 1.1\nName: foo\n'
+                              'Version: 1.0\nRequires: bar\n')
+            self.assertEqual(metadata.read_metadata(path, 'foo-1.0.tar.gz'),
+                             None)
+        finally:
+            shutil.rmtree(directory)
+    
+    def test_dynamic_requirements_are_not_static(self):
+        from userpypi.metadata import static_metadata
+        self.assertTrue(static_metadata('Metadata-Version: 2.3\nName: foo\n'))
+        self.assertFalse(static_metadata('Metadata-Version: 2.2\nName: foo\n'
+                                         'Dynamic: Requires-Dist\n'))
+        self.assertFalse(static_metadata('Metadata-Version: 2.1\nName: foo\n'))
+
+class TestRequiresPython(PackageTestCase):
+    
+    def test_requires_python_follows_release(self):
+        release = self.create_release(requires_python='>=2.6')
+        dist = self.create_distribution(release)
+        self.assertEqual(dist.requires_python_html, '&gt;=2.6')
+        
+        release = Release.objects.get(pk=release.pk)
+        release.package_info['requires_python'] = '>=2.7'
+        release.save()
+        self.assertEqual(Distribution.objects.get(
+            pk=dist.pk).requires_python_html, '&gt;=2.7')
+    
+    def test_long_specifier_is_not_cut(self):
+        specifier = '>=2.7, ' + ', '.join('!=3.%d.*' % minor for minor in
+                                          range(7))
+        self.assertTrue(len(specifier) > 64)
+        dist = self.create_distribution(
+            self.create_release(requires_python=specifier))
+        self.assertEqual(Distribution.objects.get(pk=dist.pk
+            ).requires_python_html, specifier.replace('>', '&gt;'))
+
+class TestRenderedDescription(PackageTestCase):
+    
+    def test_description_is_rendered_on_save(self):
+        release = self.create_release(description=u'First')
+        
+        release = Release.objects.get(pk=release.pk)
+        self.assertTrue(u'First' in release.rendered_description)
+        self.assertFalse(release.package_info_loaded)
+        
+        release.package_info['description'] = u'Second'
+        release.save()
+        release = Release.objects.get(pk=release.pk)
+        self.assertTrue(u'Second' in release.rendered_description)
+    
+    def test_raw_html_is_not_rendered(self):
+        from userpypi.markup import render_rst
+        html, final = render_rst(
+            u'.. raw:: html\n\n   <script>alert(1)</script>\n')
+        self.assertFalse(u'<script>' in html)
+    
+    def test_timed_out_rendering_is_not_kept(self):
+        from userpypi import markup
+        render_rst = markup.render_rst
+        markup.render_rst = lambda text: (markup.plain_text(text), False)
+        try:
+            release = self.create_release(description=u'Slow')
+        finally:
+            markup.render_rst = render_rst
+        
+        release = Release.objects.get(pk=release.pk)
+        self.assertEqual(release.description_hash, '')
+        self.assertTrue(u'Slow' in release.rendered_description)
+        self.assertNotEqual(Release.objects.get(pk=release.pk).description_hash,
+                            '')
+
+class TestPackagePermission(PackageTestCase):
+    
+    def test_read_only_maintainers_cannot_manage(self):
+        from userpypi.models import Maintainer
+        reader = User.objects.create_user('reader', 'reader@example.com',
+                                          'secret')
+        Maintainer.objects.create(package=self.package, user=reader,
+                                  permission=0)
+        self.client.login(username='reader', password='secret')
+        url = reverse('userpypi-package-manage',
+                      kwargs={'owner': 'owner', 'package': 'foo'})
+        self.assertEqual(self.client.get(url).status_code, 302)
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls.defaults import patterns, url
 from userpypi.feeds import ReleaseFeed
-from userpypi.decorators import user_owns_package, basic_auth
+from userpypi.decorators import (user_owns_package, basic_auth,
+                                 package_condition, owner_condition)
 
 from .views.packages import PackageListView, PackageDetailView, manage
 from .views.releases import ReleaseDetailView, ReleaseListView
@@ -10,28 +11,30 @@ urlpatterns = patterns('',
 
     # Basic Package Indexes
     url(r'^(?P<owner>[^/]+)/$',
-        PackageListView.as_view(),
+        owner_condition('packages')(PackageListView.as_view()),
         name="userpypi-index"),
     url(r'^(?P<owner>[^/]+)/packages/$',
-        PackageListView.as_view(), 
+        owner_condition('packages')(PackageListView.as_view()), 
         name='userpypi-package-index'),
     url(r'^(?P<owner>[^/]+)/pypi/releases/$',
-        ReleaseListView.as_view(),
+        owner_condition('releases')(ReleaseListView.as_view()),
         name='userpypi-release-list'),
     
     url(r'^(?P<owner>[^/]+)/search/$',
         'userpypi.views.packages.search',
         name='userpypi-search'),
     url(r'^(?P<owner>[^/]+)/rss/$', 
-        ReleaseFeed(), 
+        owner_condition('rss')(ReleaseFeed()), 
         name='userpypi-rss'),
     
     # Simple indexes
     url(r'^(?P<owner>[^/]+)/simple/$',
-        basic_auth(PackageListView.as_view(simple=True)),
+        basic_auth(owner_condition('simple')(
+            PackageListView.as_view(simple=True))),
         name='userpypi-package-index-simple'),
     url(r'^(?P<owner>[^/]+)/simple/(?P<package>[\w\d_\.\-]+)/?$',
-        basic_auth(PackageDetailView.as_view(simple=True)),
+        basic_auth(package_condition('simple')(
+            PackageDetailView.as_view(simple=True))),
         name='userpypi-package-simple'),
     
     # Regular Package Indexes
@@ -39,13 +42,13 @@ urlpatterns = patterns('',
         'userpypi.views.root', 
         name="userpypi-root"),
     url(r'^(?P<owner>[^/]+)/pypi/(?P<package>[\w\d_\.\-]+)/?$',
-        basic_auth(PackageDetailView.as_view()),
+        basic_auth(package_condition('package')(PackageDetailView.as_view())),
         name='userpypi-package'),
     url(r'^(?P<owner>[^/]+)/pypi/(?P<package>[\w\d_\.\-]+)/rss/$', 
-        ReleaseFeed(),
+        package_condition('rss')(ReleaseFeed()),
         name='userpypi-package-rss'),    
     url(r'^(?P<owner>[^/]+)/pypi/(?P<package>[\w\d_\.\-]+)/doap.rdf$',
-        PackageDetailView.as_view(doap=True),
+        package_condition('doap')(PackageDetailView.as_view(doap=True)),
         name='userpypi-package-doap'),
     url(r'^(?P<owner>[^/]+)/pypi/(?P<package>[\w\d_\.\-]+)/manage/$',
         manage,
@@ -54,12 +57,17 @@ urlpatterns = patterns('',
         'userpypi.views.packages.manage_versions',
         name='userpypi-package-manage-versions'),
     
+    # Distribution files
+    url(r'^(?P<owner>[^/]+)/files/(?P<package>[\w\d_\.\-]+)/(?P<version>[\w\d_\.\-]+)/(?P<filename>[^/]+)$',
+        'userpypi.views.distributions.download',
+        name='userpypi-distribution'),
+    
     # Release Indexes
     url(r'^(?P<owner>[^/]+)/pypi/(?P<package>[\w\d_\.\-]+)/(?P<version>[\w\d_\.\-]+)/$',
-        ReleaseDetailView.as_view(),
+        package_condition('release')(ReleaseDetailView.as_view()),
         name='userpypi-release'),
     url(r'^(?P<owner>[^/]+)/pypi/(?P<package>[\w\d_\.\-]+)/(?P<version>[\w\d_\.\-]+)/doap.rdf$',
-        ReleaseDetailView.as_view(doap=True),
+        package_condition('release-doap')(ReleaseDetailView.as_view(doap=True)),
         name='userpypi-release-doap'),
     url(r'^pypi/(?P<package>[\w\d_\.\-]+)/(?P<version>[\w\d_\.\-]+)/manage/$',
         'userpypi.views.releases.manage',
@@ -1,4 +1,5 @@
 import sys, traceback
+import hashlib
 from django.conf import settings
 from django.utils.importlib import import_module
 from django.core.exceptions import ImproperlyConfigured
@@ -29,3 +30,13 @@ def get_class(import_path):
         return getattr(mod, classname)
     except AttributeError:
         raise ImproperlyConfigured('Module "%s" does not define "%s"' % (module, classname))
+
+def file_digests(fh):
+    """ Returns the (md5, sha256) hex digests of a django File, reading it a
+    chunk at a time """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    for chunk in fh.chunks():
+        md5.update(chunk)
+        sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
@@ -16,7 +16,7 @@ def root(request, fallback_view=None, **kwargs):
 
     if request.method == 'POST':
         if request.META['CONTENT_TYPE'] == 'text/xml':
-            return parse_xmlrpc_request(request)
+            return parse_xmlrpc_request(request, **kwargs)
         parse_distutils_request(request)
         action = request.POST.get(':action','')
     else:
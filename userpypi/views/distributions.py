@@ -0,0 +1,166 @@
+from django.core.servers.basehttp import FileWrapper
+from django.http import Http404, HttpResponse
+from django.utils.http import urlquote
+
+from userpypi.decorators import get_package_permission
+from userpypi.downloads import count_download
+from userpypi.http import (HttpResponseUnauthorized,
+                           HttpResponseRequestedRangeNotSatisfiable,
+                           login_basic_auth, parse_range_header)
+from userpypi.metadata import METADATA_SUFFIX
+from userpypi.models import Distribution
+from userpypi.settings import (DOWNLOAD_SENDFILE_HEADER,
+                               DOWNLOAD_ACCEL_REDIRECT_PREFIX,
+                               DOWNLOAD_CHUNK_SIZE)
+
+
+def download(request, owner, package, version, filename):
+    """
+    Serve a distribution file, or its metadata file when filename is the
+    name of the distribution followed by METADATA_SUFFIX. Files of private
+    packages are only served to users with access to the package, who may
+    authenticate with basic authentication like the simple index. The
+    transfer itself is left to the front-end server when
+    DOWNLOAD_SENDFILE_HEADER is set.
+    """
+    dists = Distribution.objects.select_related('release__package').filter(
+        release__package__owner__username=owner,
+        release__package__name=package, release__version=version)
+    metadata = False
+    for dist in dists:
+        if dist.filename == filename:
+            break
+        if dist.metadata and dist.filename + METADATA_SUFFIX == filename:
+            metadata = True
+            break
+    else:
+        raise Http404(u"No distribution named %s" % (filename,))
+
+    if dist.release.package.private:
+        user = request.user
+        if not user.is_authenticated():
+            user = login_basic_auth(request)
+            if not user:
+                return HttpResponseUnauthorized('pypi')
+        package_id, permission = get_package_permission(user, owner, package)
+        if permission is None:
+            raise Http404(u"No distribution named %s" % (filename,))
+
+    if metadata:
+        return serve_metadata(dist)
+    
+    response = serve_distribution(request, dist)
+    # Requests resuming an interrupted download are not counted again. The
+    # range is read from the request as front-end servers answer it
+    # themselves, while Django still sees a 200 response.
+    byte_range = request.META.get('HTTP_RANGE', '').replace(' ', '')
+    if request.method != 'HEAD' and response.status_code in (200, 206) and (
+            not byte_range or byte_range.startswith('bytes=0-')):
+        count_download(dist)
+    return response
+
+def serve_metadata(dist):
+    """ Returns a response with the metadata file of dist. Metadata files
+    are small, so they are always sent by Django. """
+    fh = dist.metadata.storage.open(dist.metadata.name, 'rb')
+    try:
+        response = HttpResponse(fh.read(),
+                                content_type='text/plain; charset=utf-8')
+    finally:
+        fh.close()
+    response['ETag'] = '"%s"' % (dist.metadata_sha256_digest,)
+    return response
+
+def serve_distribution(request, dist):
+    """
+    Returns a response sending the file of dist. X-Accel-Redirect points
+    nginx at DOWNLOAD_ACCEL_REDIRECT_PREFIX followed by the storage name of
+    the file, X-Sendfile and similar headers get its path on disk. Without
+    one, or when the storage has no local paths, the file is streamed by
+    stream_distribution. The front-end servers handle ranges themselves.
+    """
+    content = dist.content
+    response = None
+
+    if DOWNLOAD_SENDFILE_HEADER == 'X-Accel-Redirect':
+        response = HttpResponse(content_type='application/octet-stream')
+        response['X-Accel-Redirect'] = '%s/%s' % (
+            DOWNLOAD_ACCEL_REDIRECT_PREFIX.rstrip('/'), urlquote(content.name))
+    elif DOWNLOAD_SENDFILE_HEADER:
+        try:
+            path = content.path
+        except NotImplementedError:
+            path = None
+        if path:
+            response = HttpResponse(content_type='application/octet-stream')
+            response[DOWNLOAD_SENDFILE_HEADER] = path
+
+    if response is None:
+        response = stream_distribution(request, dist)
+        if response.status_code == 416:
+            return response
+
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (
+        dist.filename,)
+    if dist.sha256_digest:
+        response['ETag'] = '"%s"' % (dist.sha256_digest,)
+    return response
+
+def _read_range(fh, start, length, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """ Yield length bytes of fh from start on, in chunks of chunk_size """
+    try:
+        if start:
+            try:
+                fh.seek(start)
+            except (AttributeError, IOError, ValueError):
+                # Storage files that cannot seek are read up to start
+                while start > 0:
+                    skipped = len(fh.read(min(chunk_size, start)))
+                    if not skipped:
+                        return
+                    start -= skipped
+        while length > 0:
+            chunk = fh.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+def stream_distribution(request, dist):
+    """
+    Returns a response streaming the file of dist a chunk at a time. A
+    single byte range is honoured with a 206 response, seeking into the file
+    rather than reading it from the start, unless an If-Range header names
+    another version of the file than the one with the sha256 of dist.
+    """
+    content = dist.content
+    # Distributions whose size was not recorded yet have a size of 0
+    size = dist.size or content.size
+    etag = '"%s"' % (dist.sha256_digest,)
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if dist.sha256_digest and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range_header(request.META.get('HTTP_RANGE'),
+                                            size)
+        except ValueError:
+            return HttpResponseRequestedRangeNotSatisfiable(size)
+
+    fh = content.storage.open(content.name, 'rb')
+    if byte_range is None:
+        response = HttpResponse(FileWrapper(fh, DOWNLOAD_CHUNK_SIZE),
+                                content_type='application/octet-stream')
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        response = HttpResponse(_read_range(fh, start, end - start + 1),
+                                content_type='application/octet-stream',
+                                status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+    if dist.sha256_digest:
+        response['Accept-Ranges'] = 'bytes'
+    return response
@@ -8,6 +8,7 @@ from django.utils.datastructures import MultiValueDict
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 
+from userpypi.cache import delete_simple_page, touch_package
 from userpypi.decorators import basic_auth
 from userpypi.forms import PackageForm, ReleaseForm
 from userpypi.models import Package, Release, Distribution, Classifier
@@ -94,6 +95,18 @@ def authorize(request_user, owner_user, package):
             return False, 'You can not update packages'
     return True, ''
 
+def commit_package(package):
+    """
+    Commit the transaction of register_or_upload. The signal handlers
+    dropped the simple page and touched package before the commit, so another
+    request may have cached the page or its validators from the old rows in
+    between. Both are refreshed once the change is visible.
+    """
+    transaction.commit()
+    delete_simple_page(package.owner.username, package.name)
+    touch_package(package)
+    transaction.commit()
+
 @basic_auth
 @transaction.commit_manually
 def register_or_upload(request, owner=None):
@@ -161,7 +174,7 @@ def register_or_upload(request, owner=None):
     release.save()
     
     if not 'content' in request.FILES:
-        transaction.commit()
+        commit_package(package)
         return HttpResponse('release registered')
     
     uploaded = request.FILES.get('content')
@@ -172,7 +185,16 @@ def register_or_upload(request, owner=None):
             transaction.rollback()
             return HttpResponseBadRequest('That file has already been uploaded...')
     
+    # The digests were computed while the upload was parsed, the one sent by
+    # the client is only used to check that the file arrived intact.
     md5_digest = request.POST.get('md5_digest','')
+    uploaded_md5 = getattr(uploaded, 'md5_digest', '')
+    uploaded_sha256 = getattr(uploaded, 'sha256_digest', '')
+    
+    if md5_digest and uploaded_md5 and md5_digest != uploaded_md5:
+        transaction.rollback()
+        return HttpResponseBadRequest('The md5_digest does not match the '
+                                      'uploaded file')
     
     try:
         new_file = Distribution.objects.create(release=release,
@@ -182,13 +204,14 @@ def register_or_upload(request, owner=None):
                                                uploader=request.user,
                                                comment=request.POST.get('comment',''),
                                                signature=request.POST.get('gpg_signature',''),
-                                               md5_digest=md5_digest)
+                                               md5_digest=uploaded_md5,
+                                               sha256_digest=uploaded_sha256)
     except Exception, e:
         transaction.rollback()
         print "Issue creating a Distribution", str(e)
         raise
     
-    transaction.commit()
+    commit_package(package)
     
     return HttpResponse('upload accepted')
 
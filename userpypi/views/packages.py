@@ -7,17 +7,24 @@ from django.forms.models import inlineformset_factory
 from django.http import Http404, HttpResponseRedirect, HttpResponse
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext, loader
+from django.utils.html import escape
 from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, UpdateView, create_update
 from django.views.generic import ListView, DetailView, UpdateView
 
+from userpypi.cache import cache_simple_page, get_simple_page
 from userpypi.decorators import user_owns_package, user_maintains_package
-from userpypi.models import Package, Release
+from userpypi.models import Package, Release, prefetch_distributions
 from userpypi.forms import SimplePackageSearchForm, PackageForm, MaintainerFormSet
-from userpypi.settings import PROXY_MISSING, PROXY_BASE_URL
+from userpypi.pagination import KeysetPaginationMixin
+from userpypi.search import FIELD_WEIGHTS, search as search_releases
+from userpypi.settings import PROXY_MISSING, PROXY_BASE_URL, LIST_PAGE_SIZE
 
 
 class OwnerObjectMixin(object):
+    # Relations fetched along with every object, see get_queryset
+    related_fields = ('owner',)
+    
     def get_context_data(self, **kwargs):
         context = super(OwnerObjectMixin, self).get_context_data(**kwargs)
         context['owner'] = self.get_owner()
@@ -43,31 +50,62 @@ class OwnerObjectMixin(object):
         Filter the queryset based on whether or not the requesting user is
         the owner of the requested objects
         """
-        if self.request.user != self.get_owner():
-            if self.owner.profile.organization:
-                params = dict(owner=self.owner)
-            else:
-                params = dict(owner=self.owner, private=False)
-        else:
-            params = dict(owner=self.owner)
-        return self.model.objects.filter(**params)
+        return visible_packages(self.request.user, self.get_owner()
+                                ).select_related(*self.related_fields)
 
 
-class PackageListView(OwnerObjectMixin, ListView):
+def visible_packages(user, owner):
+    """
+    The packages of owner that user is allowed to see
+    """
+    if user != owner and not owner.profile.organization:
+        return Package.objects.filter(owner=owner, private=False)
+    return Package.objects.filter(owner=owner)
+
+
+class PackageListView(KeysetPaginationMixin, OwnerObjectMixin, ListView):
     model = Package
     context_object_name = 'package_list'
     simple = False
     owner = None
+    # The summary of every package comes from its latest release
+    related_fields = ('owner', 'latest_release')
+    
+    def get(self, request, *args, **kwargs):
+        """
+        The simple index has to be a single document for pip, so it is
+        streamed from the list of package names instead of being paginated.
+        The names are read before streaming, as the response is iterated
+        after Django closed the database connection of the request.
+        """
+        if not self.simple:
+            return super(PackageListView, self).get(request, *args, **kwargs)
+        
+        names = list(self.get_queryset().order_by('name').values_list(
+            'name', flat=True))
+        base_url = reverse('userpypi-package-index-simple',
+                           kwargs={'owner': self.owner.username})
+        return HttpResponse(simple_index(base_url, names))
     
     def get_template_names(self):
         """
         Returns a list of template names to be used for the request. Must 
         return a list. May not be called if render_to_response is overridden.
         """
-        if self.simple:
-            return ['userpypi/package_list_simple.html']
-        else:
-            return ['userpypi/package_list.html']
+        return ['userpypi/package_list.html']
+
+
+def simple_index(base_url, names):
+    """
+    Generates the simple index page for the package names, one line at a
+    time, linking each package below base_url.
+    """
+    yield ('<html>\n<head>\n<title>Simple Package Index</title>\n</head>\n'
+           '<body>\n')
+    for name in names:
+        name = escape(name)
+        yield '<a href="%s%s/">%s</a><br/>\n' % (base_url, name, name)
+    yield '</body>\n</html>'
 
 
 class PackageDetailView(OwnerObjectMixin, DetailView):
@@ -77,6 +115,21 @@ class PackageDetailView(OwnerObjectMixin, DetailView):
     doap = False
     owner = None
     redirect = ''
+    related_fields = ('owner', 'latest_release')
+    
+    def get(self, request, *args, **kwargs):
+        """
+        Serve simple pages straight from the cache when possible. Private pages
+        are only served from the cache to their owner, everyone else goes
+        through the regular permission checks.
+        """
+        if self.simple:
+            cached = get_simple_page(kwargs.get('owner'), kwargs.get('package'))
+            if cached is not None:
+                private, content = cached
+                if not private or request.user.username == kwargs.get('owner'):
+                    return HttpResponse(content)
+        return super(PackageDetailView, self).get(request, *args, **kwargs)
     
     def render_to_response(self, context, **response_kwargs):
         """
@@ -85,11 +138,18 @@ class PackageDetailView(OwnerObjectMixin, DetailView):
         if self.redirect:
             return HttpResponseRedirect(self.redirect)
         
-        self.doap = 'doap' in self.kwargs and self.kwargs['doap']
+        if self.simple:
+            return HttpResponse(cache_simple_page(self.object))
         
+        self.doap = self.doap or self.kwargs.get('doap', False)
+
         if self.doap:
             response_kwargs['mimetype'] = 'text/xml'
-        
+            context['release_list'] = prefetch_distributions(
+                self.object.releases.all(), self.object)
+        elif self.object.latest_release:
+            prefetch_distributions([self.object.latest_release], self.object)
+
         return super(PackageDetailView, self).render_to_response(
                                                     context, **response_kwargs)
     
@@ -125,7 +185,7 @@ def manage(request, owner, package):
     template_name='userpypi/package_manage.html'
     template_object_name='package'
     form_class=PackageForm
-    obj = get_object_or_404(Package, owner__username=owner, name=package)
+    obj = request.package
     
     if request.method == 'POST':
         form = PackageForm(request.POST, instance=obj)
@@ -150,23 +210,38 @@ def manage(request, owner, package):
     return response
 
 
-def search(request, **kwargs):
+def search(request, owner, **kwargs):
+    owner = get_object_or_404(User, username=owner)
     if request.method == 'POST':
         form = SimplePackageSearchForm(request.POST)
     else:
         form = SimplePackageSearchForm(request.GET)
-    kwargs.pop('owner')
+    
+    package_list = []
     if form.is_valid():
-        q = form.cleaned_data['query']
-        kwargs['queryset'] = Package.objects.filter(owner=request.user).filter(
-            Q(name__contains=q) | Q(releases__package_info__contains=q)).distinct()
-    return PackageListView(request, **kwargs)
+        releases = Release.objects.filter(hidden=False,
+            package__in=visible_packages(request.user, owner))
+        spec = dict.fromkeys(FIELD_WEIGHTS, form.cleaned_data['query'])
+        ranked = [release.package_id for release in
+                  search_releases(spec, 'or', releases, limit=LIST_PAGE_SIZE)]
+        packages = Package.objects.select_related(
+            'owner', 'latest_release').in_bulk(ranked)
+        for pk in ranked:
+            if packages[pk] not in package_list:
+                package_list.append(packages[pk])
+    
+    return render_to_response('userpypi/package_list.html', {
+        'package_list': package_list,
+        'owner': owner,
+        'is_owner': owner == request.user,
+        'form': form,
+    }, context_instance=RequestContext(request))
 
 
 @user_maintains_package()
 def manage_versions(request, package, **kwargs):
     kwargs.pop('owner')
-    package = get_object_or_404(Package, owner=request.user, name=package)
+    package = request.package
     kwargs.setdefault('formset_factory_kwargs', {})
     kwargs['formset_factory_kwargs'].setdefault('fields', ('hidden',))
     kwargs['formset_factory_kwargs']['extra'] = 0
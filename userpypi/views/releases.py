@@ -8,14 +8,22 @@ from django.views.generic import ListView, DetailView
 from django.views.generic import create_update
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
+from django.utils.translation import ugettext as _
 
-from userpypi.decorators import user_maintains_package
-from userpypi.models import Package, Release, Distribution
+from userpypi.decorators import (user_maintains_package, csrf_exempt,
+                                 csrf_protect)
+from userpypi.http import DigestFileUploadHandler
+from userpypi.models import (Package, Release, Distribution,
+                             prefetch_distributions)
 from userpypi.forms import ReleaseForm, DistributionUploadForm
+from userpypi.pagination import KeysetPaginationMixin
 from userpypi.settings import METADATA_FORMS
 from userpypi.utils import get_class
 
 class ReleaseOwnerObjectMixin(object):
+    # Relations fetched along with every object, see get_queryset
+    related_fields = ('package', 'package__owner')
+    
     def get_context_data(self, **kwargs):
         context = super(ReleaseOwnerObjectMixin, self).get_context_data(**kwargs)
         context['owner'] = self.get_owner()
@@ -46,17 +54,22 @@ class ReleaseOwnerObjectMixin(object):
         """
         if self.request.user != self.get_owner():
             if self.owner.profile.organization:
-                params = dict(package__owner__username=self.owner)
+                params = dict(package__owner=self.owner)
             else:
-                params = dict(package__owner=self.request.user, private=False)
-        return self.model.objects.filter(**params)
+                params = dict(package__owner=self.owner, package__private=False)
+        else:
+            params = dict(package__owner=self.owner)
+        return self.model.objects.filter(**params).select_related(
+            *self.related_fields)
 
 
-class ReleaseListView(ReleaseOwnerObjectMixin, ListView):
+class ReleaseListView(KeysetPaginationMixin, ReleaseOwnerObjectMixin, ListView):
     model = Release
     context_object_name = 'release_list'
     simple = False
     owner = None
+    keyset_field = 'created'
+    keyset_descending = True
     
     def get_template_names(self):
         """
@@ -74,20 +87,29 @@ class ReleaseDetailView(ReleaseOwnerObjectMixin, DetailView):
     context_object_name = 'release'
     doap = False
     owner = None
+    related_fields = ('package', 'package__owner', 'package__latest_release')
     
     def render_to_response(self, context, **response_kwargs):
         """
         Returns a response with a template rendered with the given context.
         """
+        self.doap = self.doap or self.kwargs.get('doap', False)
+        
         if self.doap:
             response_kwargs['mimetype'] = 'text/xml'
+            context['release_list'] = prefetch_distributions(
+                self.object.package.releases.all(), self.object.package)
+        
+        prefetch_distributions([self.object], self.object.package)
         
         return super(ReleaseDetailView, self).render_to_response(context, **response_kwargs)
     
     def get_object(self):
         package = self.kwargs.get('package', None)
+        version = self.kwargs.get('version', None)
         try:
-            queryset = self.get_queryset().filter(package__name=package)
+            queryset = self.get_queryset().filter(package__name=package,
+                                                  version=version)
             obj = queryset.get()
         except ObjectDoesNotExist:
             raise Http404(_(u"No %(verbose_name)s found matching the query") %
@@ -99,7 +121,7 @@ class ReleaseDetailView(ReleaseOwnerObjectMixin, DetailView):
         Returns a list of template names to be used for the request. Must return
         a list. May not be called if render_to_response is overridden.
         """
-        self.doap = 'doap' in self.kwargs and self.kwargs['doap']
+        self.doap = self.doap or self.kwargs.get('doap', False)
         
         if self.doap:
             return ['userpypi/release_doap.xml']
@@ -109,8 +131,7 @@ class ReleaseDetailView(ReleaseOwnerObjectMixin, DetailView):
 
 @user_maintains_package()
 def manage(request, owner, package, version, **kwargs):
-    kwargs.pop('owner')
-    release = get_object_or_404(Package, owner=request.user, name=package).get_release(version)
+    release = request.package.get_release(version)
     
     if not release:
         raise Http404('Version %s does not exist for %s' % (version,
@@ -126,13 +147,12 @@ def manage(request, owner, package, version, **kwargs):
 
 @user_maintains_package()
 def manage_metadata(request, owner, package, version, **kwargs):
-    kwargs.pop('owner')
     kwargs.setdefault('template_name', 'userpypi/release_manage.html')
     kwargs.setdefault('template_object_name', 'release')
     kwargs.setdefault('extra_context', {})
     kwargs.setdefault('mimetype', settings.DEFAULT_CONTENT_TYPE)
     
-    release = get_object_or_404(Package, owner=request.user, name=package).get_release(version)
+    release = request.package.get_release(version)
     
     if not release:
         raise Http404('Version %s does not exist for %s' % (version,
@@ -179,7 +199,7 @@ def manage_metadata(request, owner, package, version, **kwargs):
 
 @user_maintains_package()
 def manage_files(request, package, version, **kwargs):
-    release = get_object_or_404(Package, owner=request.user, name=package).get_release(version)
+    release = request.package.get_release(version)
     
     if not release:
         raise Http404('Version %s does not exist for %s' % (version,
@@ -217,9 +237,17 @@ def manage_files(request, package, version, **kwargs):
                               context_instance=RequestContext(request),
                               mimetype=kwargs['mimetype'])
 
+@csrf_exempt
 @user_maintains_package()
 def upload_file(request, package, version, **kwargs):
-    release = get_object_or_404(Package, owner=request.user, name=package).get_release(version)
+    # The upload handlers can only be replaced before the body is parsed, so
+    # the CSRF check is deferred to _upload_file.
+    request.upload_handlers.insert(0, DigestFileUploadHandler(request))
+    return _upload_file(request, package, version, **kwargs)
+
+@csrf_protect
+def _upload_file(request, package, version, **kwargs):
+    release = request.package.get_release(version)
     
     if not release:
         raise Http404('Version %s does not exist for %s' % (version,
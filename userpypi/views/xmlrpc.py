@@ -1,10 +1,17 @@
+import calendar
+import datetime
 import xmlrpclib
 
+from django.contrib.auth.models import User
+from django.db.models import Max
 from django.http import HttpResponseNotAllowed, HttpResponse
 
-from userpypi.models import Package, Release
+from userpypi.models import Package, Release, Distribution, Journal
+from userpypi.decorators import get_package_permission
+from userpypi.search import search as search_releases
 from userpypi.settings import XMLRPC_COMMANDS
 from userpypi.utils import get_class
+from userpypi.views.packages import visible_packages
 
 class XMLRPCResponse(HttpResponse):
     """ A wrapper around the base HttpResponse that dumps the output for xmlrpc
@@ -14,50 +21,100 @@ class XMLRPCResponse(HttpResponse):
                                                              methodresponse=methodresponse),
                                              *args, **kwargs)
 
-def parse_xmlrpc_request(request):
+def parse_xmlrpc_request(request, **kwargs):
     """
-    Parse the request and dispatch to the appropriate view
+    Parse the request and dispatch to the appropriate view. The keyword
+    arguments of the url, such as the owner of the index, are passed on to
+    the view.
     """
     args, command = xmlrpclib.loads(request.raw_post_data)
     
     if command in XMLRPC_COMMANDS:
-        return get_class(XMLRPC_COMMANDS[command])(request, *args)
+        return get_class(XMLRPC_COMMANDS[command])(request, *args, **kwargs)
     else:
         return HttpResponseNotAllowed(XMLRPC_COMMANDS.keys())
 
-def list_packages(request):
-    return XMLRPCResponse(params=(list(Package.objects.all().values_list('name', flat=True)),),
-                          content_type='text/xml')
+def list_packages(request, owner=None, **kwargs):
+    """ The response is streamed one package name at a time, so that it
+    doesn't have to be built in memory for large indexes. The names are read
+    first, the database connection is closed before the response is sent.
+    The index of an owner lists the packages the user may see, the others
+    only list public packages. """
+    if owner is not None:
+        try:
+            owner = User.objects.get(username=owner)
+        except User.DoesNotExist:
+            return XMLRPCResponse(params=([],))
+        packages = visible_packages(request.user, owner)
+    else:
+        packages = Package.objects.filter(private=False)
+    names = list(packages.order_by('name').values_list('name',
+                                                       flat=True).distinct())
+    
+    def response():
+        yield ("<?xml version='1.0'?>\n<methodResponse>\n<params>\n"
+               "<param>\n<value><array><data>\n")
+        for name in names:
+            yield '<value><string>%s</string></value>\n' % (
+                xmlrpclib.escape(name.encode('utf-8')),)
+        yield "</data></array></value>\n</param>\n</params>\n</methodResponse>\n"
+    
+    return HttpResponse(response(), content_type='text/xml')
 
-def package_releases(request, package_name, show_hidden=False):
+def package_releases(request, package_name, show_hidden=False, **kwargs):
     try:
         return XMLRPCResponse(params=(list(Package.objects.get(name=package_name).releases.filter(hidden=show_hidden).values_list('version', flat=True)),))
     except Package.DoesNotExist:
         return XMLRPCResponse(params=([],))
 
-def release_urls(request, package_name, version):
+def release_urls(request, package_name, version, owner=None, **kwargs):
+    """
+    release_urls(package_name, version)
+    
+    Retrieve a list of download URLs for the given package release. Returns a list of dicts with the following keys: url, packagetype ('sdist', 'bdist', etc), filename, size, md5_digest, sha256_digest, downloads, upload_time, has_sig, python_version (required version, or 'source', or 'any'), comment_text
+    
+    The files are read with a single query joining the release, package and
+    owner, without asking the storage. Without an owner the public package
+    of that name is used. Private packages are only listed to users with
+    access to them.
+    """
     base_url = '%s://%s' % (request.is_secure() and 'https' or 'http',
                               request.get_host())
-    dists = []
-    try:
-        for dist in Package.objects.get(name=package_name).releases.get(version=version).distributions.all():
-            dists.append({
-                'url': '%s%s' % (base_url, dist.get_absolute_url()),
-                'packagetype': dist.filetype,
-                'filename': dist.filename,
-                'size': dist.content.size,
-                'md5_digest': dist.md5_digest,
-                'downloads': 0,
-                'has_sig': len(dist.signature)>0,
-                'python_version': dist.pyversion,
-                'comment_text': dist.comment
-            })
-    except (Package.DoesNotExist, Release.DoesNotExist):
-        pass
+    dists = Distribution.objects.select_related('release__package__owner'
+        ).filter(release__package__name=package_name,
+                 release__version=version).order_by('release__package', 'id')
+    if owner is not None:
+        dists = dists.filter(release__package__owner__username=owner)
+    else:
+        dists = dists.filter(release__package__private=False)
+    
+    output = []
+    package = None
+    for dist in dists:
+        if package is None:
+            package = dist.release.package
+            if package.private and get_package_permission(request.user,
+                    package.owner.username, package.name)[1] is None:
+                break
+        elif dist.release.package_id != package.pk:
+            break
+        output.append({
+            'url': '%s%s' % (base_url, dist.get_absolute_url()),
+            'packagetype': dist.filetype,
+            'filename': dist.filename,
+            'size': dist.size,
+            'md5_digest': dist.md5_digest,
+            'sha256_digest': dist.sha256_digest,
+            'downloads': dist.downloads,
+            'upload_time': dist.created,
+            'has_sig': len(dist.signature)>0,
+            'python_version': dist.pyversion,
+            'comment_text': dist.comment
+        })
     
-    return XMLRPCResponse(params=(dists,))
+    return XMLRPCResponse(params=(output,))
 
-def release_data(request, package_name, version):
+def release_data(request, package_name, version, **kwargs):
     output = {
         'name': '',
         'version': '',
@@ -93,7 +150,7 @@ def release_data(request, package_name, version):
     
     return XMLRPCResponse(params=(output,))
 
-def search(request, spec, operator='or'):
+def search(request, spec, operator='and', owner=None, **kwargs):
     """
     search(spec[, operator])
     
@@ -114,26 +171,87 @@ def search(request, spec, operator='or'):
     download_url
     Arguments for different fields are combined using either "and" (the default) or "or". Example: search({'name': 'foo', 'description': 'bar'}, 'or'). The results are returned as a list of dicts {'name': package name, 'version': package release version, 'summary': package release summary}
     
-    changelog(since)
+    Only the name, summary, keywords, author and description fields are
+    indexed, the others are ignored. Searches through the index of an owner
+    see the packages the user may read, the others only see public packages.
+    """
+    releases = Release.objects.filter(hidden=False)
+    if owner is not None:
+        try:
+            owner = User.objects.get(username=owner)
+        except User.DoesNotExist:
+            return XMLRPCResponse(params=([],))
+        releases = releases.filter(
+            package__in=visible_packages(request.user, owner))
+    else:
+        releases = releases.filter(package__private=False)
     
-    Retrieve a list of four-tuples (name, version, timestamp, action) since the given timestamp. All timestamps are UTC values. The argument is a UTC integer seconds since the epoch.
+    output = []
+    for release in search_releases(spec, operator, releases):
+        output.append({
+            'name': release.package.name,
+            'version': release.version,
+            'summary': release.summary,
+            '_pypi_ordering': release.score,
+        })
+    return XMLRPCResponse(params=(output,))
+
+def _journal(request, owner):
+    """
+    The journal entries the user may see, of the index of owner or of the
+    public packages of all indexes
     """
+    if owner is None:
+        return Journal.objects.filter(private=False)
+    try:
+        owner = User.objects.get(username=owner)
+    except User.DoesNotExist:
+        return Journal.objects.none()
+    if request.user != owner and not owner.profile.organization:
+        return Journal.objects.filter(owner=owner, private=False)
+    return Journal.objects.filter(owner=owner)
+
+def _timestamp(value):
+    return calendar.timegm(value.utctimetuple())
+
+def changelog(request, since, with_ids=False, owner=None, **kwargs):
+    """
+    changelog(since[, with_ids])
     
-    output = {
-        'name': '',
-        'version': '',
-        'summary': '',
-    }
+    Retrieve a list of four-tuples (name, version, timestamp, action) since the given timestamp. All timestamps are UTC values. The argument is a UTC integer seconds since the epoch. With with_ids the serial of each entry is appended to its tuple.
+    """
+    entries = _journal(request, owner).filter(
+        timestamp__gt=datetime.datetime.utcfromtimestamp(since))
+    output = []
+    for serial, name, version, timestamp, action in entries.values_list(
+            'id', 'name', 'version', 'timestamp', 'action'):
+        entry = [name, version, _timestamp(timestamp), action]
+        if with_ids:
+            entry.append(serial)
+        output.append(entry)
     return XMLRPCResponse(params=(output,))
 
-def changelog(since):
-    output = {
-        'name': '',
-        'version': '',
-        'timestamp': '',
-        'action': '',
-    }
+def changelog_last_serial(request, owner=None, **kwargs):
+    """
+    changelog_last_serial()
+    
+    Retrieve the last event's serial id.
+    """
+    serial = _journal(request, owner).aggregate(serial=Max('id'))['serial']
+    return XMLRPCResponse(params=(serial or 0,))
+
+def changelog_since_serial(request, since_serial, owner=None, **kwargs):
+    """
+    changelog_since_serial(since_serial)
+    
+    Retrieve a list of five-tuples (name, version, timestamp, action, serial) since the event identified by the given serial.
+    """
+    entries = _journal(request, owner).filter(id__gt=since_serial)
+    output = []
+    for serial, name, version, timestamp, action in entries.values_list(
+            'id', 'name', 'version', 'timestamp', 'action'):
+        output.append([name, version, _timestamp(timestamp), action, serial])
     return XMLRPCResponse(params=(output,))
 
-def ratings(request, name, version, since):
+def ratings(request, name, version, since, **kwargs):
     return XMLRPCResponse(params=([],))